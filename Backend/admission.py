@@ -0,0 +1,78 @@
+import asyncio
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+
+class AdmissionController:
+    """
+    Limits how many expensive computations run at once and how many may wait for a slot. Work that arrives
+    when every slot is busy and the queue is full is rejected with 429 Too Many Requests and a Retry-After
+    header estimated from recent run times, instead of piling up behind the running work.
+
+    Queue depth, wait times and run times are recorded so the limits can be sized from real traffic.
+    """
+    def __init__(self, max_concurrency: int, max_queue: int, default_retry_after: int):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_retry_after = default_retry_after
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.completed = 0
+        self.total_run = 0.0
+
+    def retry_after(self) -> int:
+        if not self.completed:
+            return self.default_retry_after
+        mean_run = self.total_run / self.completed
+        return max(1, math.ceil(mean_run * (self.waiting + 1) / self.max_concurrency))
+
+    async def run(self, function: Callable[[], Awaitable[Any]]) -> Any:
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code = 429,
+                detail = "Too many clustering requests, please retry later",
+                headers = {"Retry-After": str(self.retry_after())}
+            )
+
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        wait = time.perf_counter() - queued_at
+        self.admitted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.running += 1
+        started_at = time.perf_counter()
+
+        try:
+            return await function()
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self.total_run += time.perf_counter() - started_at
+            self.semaphore.release()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "mean_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "mean_run_seconds": self.total_run / self.completed if self.completed else 0.0,
+        }
@@ -1,24 +1,42 @@
+import asyncio
 import json
+import logging
 import os
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, Security, HTTPException
+from typing import List, Literal, Optional, Tuple
+from fastapi import Depends, FastAPI, Header, Path, Query, Security, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security.api_key import APIKeyHeader
 from fastapi.staticfiles import StaticFiles
 
-import geopandas as gpd
-import numpy as np
-import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+import asyncpg
+import orjson
 from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 
-from models import KMeansPostalModelInput, KMeansCommunityModelInput
-from utils import evaluate_clustering_performance, get_selected_features, wkb_to_wkt
+from admission import AdmissionController
+from cache import CachedResponse, DatasetVersionListener, LRUCache, ResponseCache, SingleFlight, cached_response, make_etag
+from clustering import (
+    CLUSTERING_DATASETS, ClusteringFit, ClusteringPool, ClusteringSnapshot, build_snapshot, catalogue_fit, cluster_info, 
+    cluster_info_full, cluster_map, evaluate_n_clusters, feature_mask, fit_snapshot
+)
+from models import (
+    ARROW_STREAM_MEDIA_TYPE, DEFAULT_PAGE_LIMIT, GEOJSON_MEDIA_TYPE, MINIBATCH_PARAMETERS, NDJSON_MEDIA_TYPE, 
+    PARQUET_MEDIA_TYPE, AggregateQueryParams, KMeansCommunityArtifactsInput, KMeansCommunityModelInput, 
+    KMeansCommunitySweepInput, KMeansPostalArtifactsInput, KMeansPostalModelInput, KMeansPostalSweepInput, 
+    TableQueryParams
+)
+from utils import (
+    RowJSONResponse, StaleCursorError, arrow_ipc_bytes, compile_filters, decode_cursor, dumps_rows, embed_map_assets, 
+    encode_cursor, find_map_assets, get_selected_features, parse_aggregates, parse_bbox, 
+    parse_fields, parse_filters, parquet_bytes, quote_identifier, rows_to_arrow
+)
+
+logger = logging.getLogger(__name__)
 
 # Load the environment variables
 load_dotenv()
@@ -30,9 +48,94 @@ RDS_HOST = os.environ.get("RDS_HOST")
 RDS_PORT = os.environ.get("RDS_PORT")
 RDS_DATABASE = os.environ.get("RDS_DATABASE")
 
-# Define the map constants
-MAP_ZOOM = 9
-MAP_CENTER = {"lat": 51.096, "lon": -113.954}
+# Define the database connection pool settings
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_WARMUP = int(os.environ.get("DB_POOL_WARMUP", 5))
+
+# Define the number of prepared statements cached per connection
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500))
+
+# Define the number of rows fetched per round trip when streaming a table
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 1000))
+
+# Define the tables that can be aggregated, keyed by the name of their table route
+AGGREGATE_TABLES = {
+    "building_permits": "building_permits",
+    "combined_boundaries_and_profile_data": "combined_boundaries_and_profile_data",
+    "community_crime_statistics": "community_crime_statistics",
+    "community_disorder_statistics": "community_disorder_statistics",
+    "community_district_boundaries": "community_district_boundaries",
+    "community_profiles": "community_profiles",
+    "community_services": "community_services",
+    "current_year_property_assessments": "current_year_property_assessments",
+    "development_permits": "development_permits",
+    "excluded_communities": "excluded_communities_gdf",
+    "excluded_postal_codes": "excluded_postal_codes_gdf",
+    "land_use_districts": "land_use_districts",
+    "land_use_districts_info": "land_use_districts_info",
+    "postal_boundaries": "postal_boundaries",
+    "postal_codes_with_assessed_values": "postal_codes_with_assessed_values",
+    "schools": "schools",
+    "transit_stops": "ne_transit_stops_gdf",
+    "vacant_apartments": "vacant_apartments",
+}
+
+# Define the polygon layers the Data Pipeline stores simplified copies of, and the zoom levels of the copies.
+# These must match SIMPLIFIED_LAYERS and SIMPLIFICATION_ZOOMS in Data Pipeline/db_utils.py.
+SIMPLIFIED_LAYERS = {
+    "community_district_boundaries",
+    "combined_boundaries_and_profile_data",
+    "excluded_communities_gdf",
+    "postal_boundaries",
+    "postal_codes_with_assessed_values",
+    "excluded_postal_codes_gdf",
+    "land_use_districts",
+}
+SIMPLIFICATION_ZOOMS = [6, 8, 10, 12]
+
+# Define the column the Data Pipeline numbers the rows of each table in. It must match ROW_ID_COLUMN in 
+# Data Pipeline/db_utils.py.
+ROW_ID_COLUMN = "__row_id"
+
+# Define the geometry column the Data Pipeline builds the GIST index on. It must match GEOMETRY_COLUMN in 
+# Data Pipeline/db_utils.py.
+GEOMETRY_COLUMN = "geometry"
+
+# Define the layers served as Mapbox Vector Tiles and the attributes each tile carries
+TILE_LAYERS = {
+    "current_year_property_assessments": ["ADDRESS", "ASSESSED_VALUE", "COMM_NAME", "LAND_USE_DESIGNATION", "PROPERTY_TYPE"],
+    "land_use_districts": ["Land Use Bylaw", "Land Use Code", "Land Use Label", "Land Use Major"],
+}
+MAX_TILE_ZOOM = 22
+MVT_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# Define the limits of the in-process response cache
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 256))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+TILE_CACHE_MAX_ENTRIES = int(os.environ.get("TILE_CACHE_MAX_ENTRIES", 20000))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Define the limits of the clustering routes: how many fits run at once, how many may wait for a slot, 
+# and the Retry-After sent when the queue is full before any run times have been measured
+CLUSTERING_MAX_CONCURRENCY = int(os.environ.get("CLUSTERING_MAX_CONCURRENCY", 2))
+CLUSTERING_MAX_QUEUE = int(os.environ.get("CLUSTERING_MAX_QUEUE", 8))
+CLUSTERING_RETRY_AFTER = int(os.environ.get("CLUSTERING_RETRY_AFTER", 5))
+
+# Define the number of worker processes the clustering work runs in
+CLUSTERING_POOL_SIZE = int(os.environ.get("CLUSTERING_POOL_SIZE", 2))
+
+# Define the number of fitted clustering results kept in memory
+CLUSTERING_FIT_CACHE_SIZE = int(os.environ.get("CLUSTERING_FIT_CACHE_SIZE", 128))
+
+# Define the channel the Data Pipeline notifies when it records a new dataset version, how long to wait 
+# before reconnecting the listener, and how often to check that its connection is still alive
+DATASET_VERSIONS_CHANNEL = "dataset_versions"
+LISTENER_RECONNECT_DELAY = float(os.environ.get("LISTENER_RECONNECT_DELAY", 5))
+LISTENER_HEALTH_CHECK_INTERVAL = float(os.environ.get("LISTENER_HEALTH_CHECK_INTERVAL", 30))
 
 # Define the API key header
 API_KEY_NAME = "AccessToken"
@@ -45,8 +148,25 @@ async def get_api_key(api_key: str = Security(api_key_header)):
     else:
         raise HTTPException(status_code = 403, detail = "Could not validate credentials")
 
+# Define the lifespan of the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await warm_up_pool()
+    listener_task = asyncio.create_task(dataset_version_listener.run())
+    await clustering_pool.start()
+    for dataset in CLUSTERING_DATASETS:
+        await refresh_clustering_snapshot(dataset)
+    yield
+    listener_task.cancel()
+    try:
+        await listener_task
+    except asyncio.CancelledError:
+        pass
+    clustering_pool.shutdown()
+    await engine.dispose()
+
 # Define the FastAPI app
-app = FastAPI(root_path = "/api")
+app = FastAPI(root_path = "/api", lifespan = lifespan)
 
 # Mount the static files
 app.mount("/static", StaticFiles(directory = "static"), name = "static")
@@ -57,16 +177,43 @@ app.add_middleware(
     allow_credentials = True,
     allow_methods = ["*"],
     allow_headers = ["*"],
+    expose_headers = ["ETag", "X-Next-Cursor"],
 )
 
 # Create a connection to the database
 connection_string = (
     f"postgresql+asyncpg://{RDS_USERNAME}:{RDS_PASSWORD}@" + 
-    f"{RDS_HOST}:{RDS_PORT}/{RDS_DATABASE}"
+    f"{RDS_HOST}:{RDS_PORT}/{RDS_DATABASE}" + 
+    f"?prepared_statement_cache_size={DB_STATEMENT_CACHE_SIZE}"
 )
 
 # Create an engine to connect to the database
-engine = create_async_engine(connection_string)
+engine = create_async_engine(
+    connection_string,
+    pool_size = DB_POOL_SIZE,
+    max_overflow = DB_MAX_OVERFLOW,
+    pool_timeout = DB_POOL_TIMEOUT,
+    pool_recycle = DB_POOL_RECYCLE,
+    pool_pre_ping = DB_POOL_PRE_PING,
+    json_deserializer = orjson.loads,
+)
+
+async def warm_up_pool():
+    """
+    Opens and validates the first connections of the pool before the app starts serving, so the first 
+    requests after a deploy do not pay for connection setup. Raises if the database cannot be reached.
+    """
+    async def open_connection():
+        connection = await engine.connect()
+        await connection.execute(text("SELECT 1;"))
+        return connection
+
+    # Hold the connections at the same time, otherwise the pool would hand out the same one each time
+    connections = await asyncio.gather(*[open_connection() for _ in range(min(DB_POOL_WARMUP, DB_POOL_SIZE))])
+
+    # Return the connections to the pool
+    for connection in connections:
+        await connection.close()
 
 # Define a session class to use for the database
 AsyncSessionLocal = sessionmaker(
@@ -78,375 +225,876 @@ async def get_db_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
         
-# Utility functions to fetch data
-async def fetch_postal_codes_with_assessed_values(db: AsyncSession):
+async def run_clustering(name: str, model, function):
+    """
+    Runs a clustering computation through the single-flight layer and admission control. Identical concurrent 
+    requests share one computation, and new computations wait for a slot or are rejected with 429 when the 
+    queue is full. The mini-batch parameters are ignored by exact k-means fits, so they are left out of the 
+    key of those requests.
+
+    name: The name of the clustering route.
+    model: The clustering parameters sent by the client.
+    function: The computation, called with the model.
+    """
+    exclude = MINIBATCH_PARAMETERS if model.algorithm == "kmeans" else None
+    key = (name, model.model_dump_json(exclude = exclude))
+    return await single_flight.run(key, lambda: clustering_admission.run(lambda: function(model)))
+
+# Cache of serialized responses, keyed by route, query parameters and dataset version
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+
+# Cache of vector tiles, kept apart so that tiles do not evict table responses
+tile_cache = ResponseCache(TILE_CACHE_MAX_ENTRIES, TILE_CACHE_MAX_BYTES)
+
+# In-memory copies of the prerendered maps, with the version of map_data they were read at. Maps are kept 
+# apart from the response cache so that table traffic cannot evict them.
+map_cache = {}
+
+# Coalesces identical concurrent table, map and clustering requests into one computation
+single_flight = SingleFlight()
+
+# Admission control of the clustering computations. It sits inside the single-flight layer, so requests 
+# that join a computation already in flight do not take a slot or a place in the queue.
+clustering_admission = AdmissionController(CLUSTERING_MAX_CONCURRENCY, CLUSTERING_MAX_QUEUE, CLUSTERING_RETRY_AFTER)
+
+# In-memory snapshots of the clustering datasets, keyed by dataset
+clustering_snapshots = {}
+
+# Worker processes for the clustering work, which load the versioned snapshots from files
+clustering_pool = ClusteringPool(CLUSTERING_POOL_SIZE)
+
+# Fitted clustering results, keyed by dataset, snapshot version, feature bitmask, number of clusters, seed and algorithm options
+clustering_fit_cache = LRUCache(CLUSTERING_FIT_CACHE_SIZE)
+
+# Background tasks started by the app, kept referenced until they finish
+background_tasks = set()
+
+# Cache of the columns of each table, mapped to their database type, with the dataset version they were read at
+table_columns = {}
+
+def invalidate_dataset(table_name: str):
+    """
+    Drops everything cached from a table after the Data Pipeline has rewritten it. Entries are keyed by 
+    version and would never be served again anyway, this frees their memory right away.
+    """
+    table_columns.pop(table_name, None)
+    response_cache.discard_where(lambda key: key[0] in ("table", "aggregate") and key[1] == table_name)
+    tile_cache.discard_where(lambda key: key[1] == table_name)
+    if table_name == "map_data":
+        map_cache.clear()
+
+    # Reload the clustering snapshots built from the table in the background, so requests do not wait for it
+    for dataset, dataset_info in CLUSTERING_DATASETS.items():
+        if table_name in (dataset_info["table"], dataset_info["excluded_table"]):
+            task = asyncio.create_task(refresh_clustering_snapshot(dataset))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
+# Define a function to open the connection the dataset version listener holds. It is kept out of the 
+# pool because it stays checked out for the lifetime of the app.
+async def connect_listener() -> asyncpg.Connection:
+    return await asyncpg.connect(
+        user = RDS_USERNAME, password = RDS_PASSWORD, host = RDS_HOST, port = RDS_PORT, database = RDS_DATABASE
+    )
+
+# Latest version of each dataset, pushed by the Data Pipeline through LISTEN/NOTIFY
+dataset_version_listener = DatasetVersionListener(
+    connect_listener, DATASET_VERSIONS_CHANNEL, invalidate_dataset, LISTENER_RECONNECT_DELAY, LISTENER_HEALTH_CHECK_INTERVAL
+)
+
+async def get_dataset_version(session: AsyncSession, table_name: str) -> Optional[str]:
+    """
+    Returns the version the Data Pipeline recorded for a table when it last wrote it, or None if no version 
+    has been recorded. Responses built from unversioned tables are not cached.
+
+    While the dataset version listener is connected, versions are answered from memory and only read from 
+    the database the first time a table is requested.
+    """
+    known, version = dataset_version_listener.get(table_name)
+    if known:
+        return version
+
+    try:
+        result = await session.execute(
+            text("SELECT version FROM dataset_versions WHERE table_name = :table_name;"), 
+            {"table_name": table_name}
+        )
+    except ProgrammingError:
+        # The dataset_versions table does not exist until the pipeline has run
+        await session.rollback()
+        return None
+
+    version = result.scalar_one_or_none()
+    dataset_version_listener.remember(table_name, version)
+    return version
+
+async def load_clustering_snapshot(dataset: str, version: tuple) -> ClusteringSnapshot:
+    dataset_info = CLUSTERING_DATASETS[dataset]
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(f"SELECT * FROM {quote_identifier(dataset_info['table'])};"))
+        rows = result.mappings().all()
+        result = await session.execute(text(f"SELECT * FROM {quote_identifier(dataset_info['excluded_table'])};"))
+        excluded_rows = result.mappings().all()
+
+    # Decoding the geometries is CPU-bound, so it runs off the event loop
+    snapshot = await asyncio.to_thread(build_snapshot, dataset, version, rows, excluded_rows)
+
+    # Unversioned snapshots are reloaded on every request, so they are sent with each task instead
+    if None not in version:
+        await clustering_pool.publish(snapshot)
+
+    clustering_snapshots[dataset] = snapshot
+
+    return snapshot
+
+async def get_clustering_snapshot(dataset: str) -> ClusteringSnapshot:
+    """
+    Returns the in-memory snapshot of a clustering dataset for the current versions of its tables. The snapshot 
+    is only reloaded from the database when a version changes. Tables without a recorded version are reloaded 
+    on every request, as they were before snapshots existed.
+    """
+    dataset_info = CLUSTERING_DATASETS[dataset]
+
+    async with AsyncSessionLocal() as session:
+        version = (
+            await get_dataset_version(session, dataset_info["table"]), 
+            await get_dataset_version(session, dataset_info["excluded_table"])
+        )
+
+    snapshot = clustering_snapshots.get(dataset)
+    if snapshot is not None and snapshot.version == version and None not in version:
+        return snapshot
+
+    return await single_flight.run(("snapshot", dataset, version), lambda: load_clustering_snapshot(dataset, version))
+
+async def load_catalogue_fit(
+    snapshot: ClusteringSnapshot, 
+    selected_features: List[str], 
+    n_clusters: int, 
+    random_state: int
+) -> Optional[ClusteringFit]:
+    """
+    Looks up the fit precomputed by the Data Pipeline's clustering catalogue for the current version of 
+    a dataset. Returns None if the catalogue has no entry for it.
+
+    snapshot: The clustering dataset.
+    selected_features: The features to cluster on, in the order they were selected.
+    n_clusters: The number of clusters.
+    random_state: The seed of the centroid initialization.
+    """
+    async with AsyncSessionLocal() as session:
+        try:
+            result = await session.execute(
+                text(
+                    "SELECT labels, centroids, scaler_mean, scaler_scale FROM clustering_catalogue "
+                    "WHERE dataset = :dataset AND features = :features AND n_clusters = :n_clusters "
+                    "AND random_state = :random_state AND version = :version;"
+                ),
+                {
+                    "dataset": snapshot.dataset,
+                    "features": json.dumps(selected_features),
+                    "n_clusters": n_clusters,
+                    "random_state": random_state,
+                    "version": snapshot.version[0],
+                }
+            )
+        except ProgrammingError:
+            # The clustering_catalogue table does not exist until the pipeline has run
+            return None
+
+        entry = result.mappings().one_or_none()
+
+    if entry is None:
+        return None
+
+    return catalogue_fit(snapshot, entry["labels"], entry["centroids"], entry["scaler_mean"], entry["scaler_scale"])
+
+async def get_clustering_fit(dataset: str, model) -> Tuple[ClusteringSnapshot, List[str], ClusteringFit]:
+    """
+    Returns the snapshot of a clustering dataset, the features selected by the model and the clustering fit for
+    them. K-Means fits are looked up in the clustering catalogue first, and only run in the clustering worker
+    processes for selections the catalogue does not cover. Mini-batch fits always run in the worker processes.
+
+    Fits of either algorithm are cached per snapshot version, so the map, info and info_full routes share one
+    fit for the same request body, and concurrent requests for the same fit wait for one computation. Fits of
+    unversioned snapshots are neither looked up in the catalogue nor cached.
+    """
+    snapshot = await get_clustering_snapshot(dataset)
+    selected_features = get_selected_features(model, dataset)
+
+    if model.algorithm == "minibatch":
+        fit_options = (model.algorithm, model.sample_size, model.max_iter, model.time_budget)
+    else:
+        fit_options = (model.algorithm,)
+
+    async def compute_fit() -> ClusteringFit:
+        try:
+            return await clustering_pool.run(
+                snapshot, fit_snapshot, selected_features, model.n_clusters, model.random_state, *fit_options
+            )
+        except ValueError as e:
+            raise HTTPException(status_code = 400, detail = str(e))
+
+    if None in snapshot.version:
+        return snapshot, selected_features, await compute_fit()
+
+    cache_key = (
+        dataset, snapshot.version, feature_mask(dataset, selected_features), model.n_clusters, model.random_state
+    ) + fit_options
+    fit = clustering_fit_cache.get(cache_key)
+
+    if fit is None:
+        async def compute_and_cache_fit() -> ClusteringFit:
+            fit = None
+            if model.algorithm == "kmeans":
+                fit = await load_catalogue_fit(snapshot, selected_features, model.n_clusters, model.random_state)
+            if fit is None:
+                fit = await compute_fit()
+            clustering_fit_cache.set(cache_key, fit)
+            return fit
+
+        fit = await single_flight.run(("fit",) + cache_key, compute_and_cache_fit)
+
+    return snapshot, selected_features, fit
+
+async def refresh_clustering_snapshot(dataset: str):
+    try:
+        await get_clustering_snapshot(dataset)
+    except Exception:
+        logger.exception(f"Could not load the {dataset} clustering snapshot")
+
+async def get_table_columns(session: AsyncSession, table_name: str, version: Optional[str]):
+    if table_name not in table_columns or table_columns[table_name][0] != version:
+        result = await session.execute(
+            text(
+                "SELECT column_name, udt_name FROM information_schema.columns " 
+                "WHERE table_schema = current_schema() AND table_name = :table_name " 
+                "ORDER BY ordinal_position;"
+            ), 
+            {"table_name": table_name}
+        )
+        columns = dict(result.all())
+        if not columns:
+            raise HTTPException(status_code = 404, detail = "Table not found")
+        table_columns[table_name] = (version, columns)
+    return table_columns[table_name][1]
+
+async def resolve_table(session: AsyncSession, table_name: str, zoom: Optional[float]) -> str:
+    """
+    Returns the simplified copy of a layer for a zoom level: the coarsest copy that is still detailed enough 
+    at that zoom. Returns the layer itself if no zoom is given, the zoom is beyond the most detailed copy, or 
+    the copy has not been created by the Data Pipeline yet.
+    """
+    if zoom is None or table_name not in SIMPLIFIED_LAYERS:
+        return table_name
+
+    levels = [level for level in SIMPLIFICATION_ZOOMS if level >= zoom]
+    if not levels:
+        return table_name
+
+    simplified_table_name = f"{table_name}_z{min(levels)}"
+    if simplified_table_name in table_columns:
+        return simplified_table_name
+
+    result = await session.execute(
+        text("SELECT to_regclass(CAST(:table_name AS text)) IS NOT NULL;"), 
+        {"table_name": simplified_table_name}
+    )
+    return simplified_table_name if result.scalar() else table_name
+
+async def stream_table(query: str, query_params: dict):
+    """
+    Streams the rows of a query as newline-delimited JSON using a server-side cursor, so only one batch 
+    of rows is held in memory at a time. The stream uses its own session because the request's session 
+    is closed before the response body is sent.
+    """
+    async with AsyncSessionLocal() as session:
+        result = await session.stream(text(query), query_params)
+        async for rows in result.mappings().partitions(STREAM_BATCH_SIZE):
+            yield b"".join(
+                dumps_rows({key: value for key, value in row.items() if key != "__cursor"}) + b"\n"
+                for row in rows
+            )
+
+async def fetch_table(db: AsyncSession, table_name: str, params: TableQueryParams):
+    """
+    Fetches the requested columns and page of a table. Projection and pagination are pushed down into SQL.
+
+    The Data Pipeline numbers the rows of each table in an indexed row id column, so pages are keyed on 
+    it and each page is read from the index. The row id column is not part of the responses. Tables saved 
+    before the row id existed are keyed on the physical row id (ctid) instead. The cursor of the next page 
+    is returned in the X-Next-Cursor header and is omitted on the last page. Row ids are only meaningful 
+    within one dataset version, so cursors carry the version and are rejected with 410 Gone once the table 
+    has been replaced.
+
+    Responses are cached per dataset version and carry a strong ETag, so repeated requests are answered 
+    from memory and clients revalidating with If-None-Match get a 304. Gzip and brotli variants are 
+    stored with the cached body and served according to Accept-Encoding.
+
+    Clients that send "Accept: application/x-ndjson" get the rows streamed as newline-delimited JSON 
+    instead. Streamed responses bypass the cache and do not carry the X-Next-Cursor header.
+
+    Tables with a geometry column can be filtered to a viewport with bbox, which is answered from the 
+    GIST index the Data Pipeline creates on the geometry column. Polygon layers accept a zoom level and 
+    are then read from the matching simplified copy.
+
+    Geometry columns are returned as hex WKB unless geometry_format=geojson is given, in which case Postgres 
+    encodes them as GeoJSON with the requested coordinate precision. Clients that send 
+    "Accept: application/geo+json" get a GeoJSON FeatureCollection built the same way.
+
+    Clients that send "Accept: application/vnd.apache.arrow.stream" or "application/vnd.apache.parquet" 
+    get an Arrow IPC stream or a Parquet file, with geometry columns encoded as binary WKB by Postgres.
+
+    Any other query parameter filters rows on the column of the same name. Filters are validated against 
+    the columns of the table and compiled into bound parameters, so they can use the b-tree indexes the 
+    Data Pipeline creates on the commonly filtered columns.
+    """
+    async with db as session:
+        table_name = await resolve_table(session, table_name, params.zoom)
+        version = await get_dataset_version(session, table_name)
+        output_format = params.output_format
+        cache_key = (
+            "table", table_name, output_format, params.fields, params.limit, params.cursor, params.bbox, 
+            params.geometry_format, params.precision, params.filters, version
+        )
+
+        if version is not None and not params.stream:
+            entry = response_cache.get(cache_key)
+            if entry is not None:
+                return await cached_response(entry, params.if_none_match, params.accept_encoding)
+
+        columns = await get_table_columns(session, table_name, version)
+        keyset_column = ROW_ID_COLUMN if ROW_ID_COLUMN in columns else "ctid"
+        columns = {column: column_type for column, column_type in columns.items() if column != ROW_ID_COLUMN}
+
+        try:
+            selected_columns = parse_fields(params.fields, columns)
+            after = decode_cursor(params.cursor, table_name, version, keyset_column) if params.cursor else None
+            bbox = parse_bbox(params.bbox) if params.bbox else None
+            filters = parse_filters(params.filters, columns)
+        except StaleCursorError as e:
+            raise HTTPException(status_code = 410, detail = str(e))
+        except ValueError as e:
+            raise HTTPException(status_code = 400, detail = str(e))
+
+        geometry_columns = [column for column in selected_columns if columns[column] == "geometry"]
+        conditions, query_params = compile_filters(filters)
+
+        if bbox is not None:
+            table_geometry_columns = [column for column, column_type in columns.items() if column_type == "geometry"]
+            if not table_geometry_columns:
+                raise HTTPException(status_code = 400, detail = "bbox is only supported on tables with a geometry column")
+
+            # && compares bounding boxes, so Postgres can answer it from the GIST index on the indexed geometry column
+            bbox_column = GEOMETRY_COLUMN if GEOMETRY_COLUMN in table_geometry_columns else table_geometry_columns[0]
+            conditions.append(
+                f"{quote_identifier(bbox_column)} && ST_MakeEnvelope(:minx, :miny, :maxx, :maxy, 4326)"
+            )
+            query_params.update(zip(("minx", "miny", "maxx", "maxy"), bbox))
+
+        if output_format in ("arrow", "parquet"):
+            select_list = ", ".join(
+                f"ST_AsBinary({quote_identifier(column)}) AS {quote_identifier(column)}" 
+                if column in geometry_columns else quote_identifier(column)
+                for column in selected_columns
+            )
+        elif output_format == "geojson" or params.geometry_format == "geojson":
+            select_list = ", ".join(
+                f"ST_AsGeoJSON({quote_identifier(column)}, CAST(:precision AS integer))::json AS {quote_identifier(column)}" 
+                if column in geometry_columns else quote_identifier(column)
+                for column in selected_columns
+            )
+            query_params["precision"] = params.precision
+        elif params.fields or keyset_column == ROW_ID_COLUMN:
+            select_list = ", ".join(quote_identifier(column) for column in selected_columns)
+        else:
+            select_list = "*"
+
+        if keyset_column == ROW_ID_COLUMN:
+            keyset, cursor_value, after_value = quote_identifier(ROW_ID_COLUMN), quote_identifier(ROW_ID_COLUMN), ":after"
+        else:
+            keyset, cursor_value, after_value = "ctid", "ctid::text", "CAST(CAST(:after AS text) AS tid)"
+
+        if params.paginated:
+            limit = params.limit or DEFAULT_PAGE_LIMIT
+            if after is not None:
+                conditions.append(f"{keyset} > {after_value}")
+                query_params["after"] = after
+            query_params["limit"] = limit
+
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        if params.paginated:
+            query = (
+                f"SELECT {cursor_value} AS __cursor, {select_list} FROM {quote_identifier(table_name)}" 
+                f"{where_clause} ORDER BY {keyset} LIMIT :limit;"
+            )
+        else:
+            query = f"SELECT {select_list} FROM {quote_identifier(table_name)}{where_clause};"
+
+        if params.stream:
+            return StreamingResponse(stream_table(query, query_params), media_type = NDJSON_MEDIA_TYPE, headers = {"Vary": "Accept"})
+
+        async def build_entry() -> CachedResponse:
+            async with AsyncSessionLocal() as query_session:
+                result = await query_session.execute(text(query), query_params)
+                rows = result.mappings().all()
+
+            # The body depends on the Accept header as well as Accept-Encoding, so shared caches must key on both
+            headers = {"Vary": "Accept, Accept-Encoding"}
+
+            if params.paginated:
+                if len(rows) == limit:
+                    headers["X-Next-Cursor"] = encode_cursor(table_name, version, keyset_column, rows[-1]["__cursor"])
+                rows = [{key: value for key, value in row.items() if key != "__cursor"} for row in rows]
+
+            if output_format == "arrow":
+                body = arrow_ipc_bytes(rows_to_arrow(rows, geometry_columns))
+                entry = CachedResponse(body, ARROW_STREAM_MEDIA_TYPE, make_etag(body), headers)
+            elif output_format == "parquet":
+                # Parquet is compressed internally, so it is not compressed again for transfer
+                body = parquet_bytes(rows_to_arrow(rows, geometry_columns))
+                entry = CachedResponse(body, PARQUET_MEDIA_TYPE, make_etag(body), headers, compressible = False)
+            elif output_format == "geojson":
+                geometry_column = geometry_columns[0] if geometry_columns else None
+                features = [
+                    {
+                        "type": "Feature", 
+                        "geometry": row[geometry_column] if geometry_column else None, 
+                        "properties": {key: value for key, value in row.items() if key != geometry_column},
+                    }
+                    for row in rows
+                ]
+                body = dumps_rows({"type": "FeatureCollection", "features": features})
+                entry = CachedResponse(body, GEOJSON_MEDIA_TYPE, make_etag(body), headers)
+            else:
+                body = RowJSONResponse(rows).body
+                entry = CachedResponse(body, "application/json", make_etag(body), headers)
+
+            if version is not None:
+                response_cache.set(cache_key, entry)
+
+            return entry
+
+        # Identical concurrent requests share one query. The request's connection is released while it runs.
+        await session.close()
+        entry = await single_flight.run(cache_key, build_entry)
+
+        return await cached_response(entry, params.if_none_match, params.accept_encoding)
+
+async def fetch_aggregate(db: AsyncSession, table: str, params: AggregateQueryParams):
+    """
+    Groups the rows of a table and computes the requested aggregates in Postgres, so clients receive one row per 
+    group instead of the whole table. Column filters are applied before grouping, in the same way as on the table 
+    routes. Results are cached per dataset version like the table routes.
+    """
+    if table not in AGGREGATE_TABLES:
+        raise HTTPException(status_code = 404, detail = "Table not found")
+
+    table_name = AGGREGATE_TABLES[table]
+
     async with db as session:
-        result = await db.execute(text("SELECT * FROM postal_codes_with_assessed_values;"))
-        result_list = result.mappings().all()
-        return result_list
-    
-async def fetch_combined_boundaries_and_profile_data(db: AsyncSession):
+        version = await get_dataset_version(session, table_name)
+        cache_key = ("aggregate", table_name, params.group_by, params.aggregates, params.filters, version)
+
+        if version is not None:
+            entry = response_cache.get(cache_key)
+            if entry is not None:
+                return await cached_response(entry, params.if_none_match, params.accept_encoding)
+
+        columns = await get_table_columns(session, table_name, version)
+
+        try:
+            group_by = parse_fields(params.group_by, columns) if params.group_by else []
+            aggregates = parse_aggregates(params.aggregates, columns)
+            filters = parse_filters(params.filters, columns)
+        except ValueError as e:
+            raise HTTPException(status_code = 400, detail = str(e))
+
+        if any(columns[column] == "geometry" for column in group_by):
+            raise HTTPException(status_code = 400, detail = "Cannot group by a geometry column")
+
+        conditions, query_params = compile_filters(filters)
+
+        select_list = ", ".join(
+            [quote_identifier(column) for column in group_by] + 
+            [f"{aggregate_sql} AS {quote_identifier(name)}" for name, aggregate_sql in aggregates]
+        )
+        query = f"SELECT {select_list} FROM {quote_identifier(table_name)}"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        if group_by:
+            group_list = ", ".join(quote_identifier(column) for column in group_by)
+            query += f" GROUP BY {group_list} ORDER BY {group_list}"
+
+        result = await session.execute(text(query + ";"), query_params)
+        body = RowJSONResponse(result.mappings().all()).body
+        entry = CachedResponse(body, "application/json", make_etag(body))
+
+        if version is not None:
+            response_cache.set(cache_key, entry)
+
+        return await cached_response(entry, params.if_none_match, params.accept_encoding)
+
+async def fetch_tile(db: AsyncSession, layer: str, z: int, x: int, y: int, if_none_match: Optional[str], accept_encoding: Optional[str]):
+    """
+    Renders a Mapbox Vector Tile of a layer with ST_AsMVT. Only the geometries that intersect the tile are 
+    read, clipped and quantized by Postgres, so the full geometry set never leaves the database. Tiles are 
+    cached per dataset version.
+    """
+    if layer not in TILE_LAYERS:
+        raise HTTPException(status_code = 404, detail = "Layer not found")
+    if x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(status_code = 400, detail = "Tile coordinates out of range")
+
     async with db as session:
-        result = await db.execute(text("SELECT * FROM combined_boundaries_and_profile_data;"))
-        result_list = result.mappings().all()
-        return result_list
-    
-async def fetch_exclude_communities_gdf(db: AsyncSession):
+        version = await get_dataset_version(session, layer)
+        cache_key = ("tile", layer, z, x, y, version)
+
+        if version is not None:
+            entry = tile_cache.get(cache_key)
+            if entry is not None:
+                return await cached_response(entry, if_none_match, accept_encoding)
+
+        attributes = "".join(f", t.{quote_identifier(column)}" for column in TILE_LAYERS[layer])
+        result = await session.execute(
+            text(
+                "WITH bounds AS (SELECT ST_TileEnvelope(CAST(:z AS integer), CAST(:x AS integer), CAST(:y AS integer)) AS geom) "
+                "SELECT ST_AsMVT(tile, CAST(:layer AS text), 4096, 'geom') FROM ("
+                f"SELECT ST_AsMVTGeom(ST_Transform(t.{quote_identifier(GEOMETRY_COLUMN)}, 3857), bounds.geom, 4096, 64, true) AS geom"
+                f"{attributes} "
+                f"FROM {quote_identifier(layer)} AS t, bounds "
+                f"WHERE t.{quote_identifier(GEOMETRY_COLUMN)} && ST_Transform(bounds.geom, 4326)"
+                ") AS tile;"
+            ),
+            {"z": z, "x": x, "y": y, "layer": layer}
+        )
+        body = bytes(result.scalar_one_or_none() or b"")
+        entry = CachedResponse(body, MVT_MEDIA_TYPE, make_etag(body))
+
+        if version is not None:
+            tile_cache.set(cache_key, entry)
+
+        return await cached_response(entry, if_none_match, accept_encoding)
+
+async def fetch_map(db: AsyncSession, name: str, assets: str, if_none_match: Optional[str], accept_encoding: Optional[str]):
+    """
+    Fetches a prerendered map from the map_data table. The stored figure JSON is read as text and sent 
+    as is, without parsing and re-encoding it. Each map is kept in memory, together with its compressed 
+    variants, until the Data Pipeline records a new version of map_data.
+
+    Maps that share boundaries store a reference to a map asset instead of the boundary GeoJSON. By default 
+    the assets are embedded into the figure once per version of the map. With assets=reference the references 
+    are sent as is, and clients fetch each asset once from /map_assets/{name}/{version}, where it can be 
+    cached indefinitely.
+    """
     async with db as session:
-        result = await db.execute(text("SELECT * FROM excluded_communities_gdf;"))
-        result_list = result.mappings().all()
-        return result_list
-    
-async def fetch_exclude_postal_codes_gdf(db: AsyncSession):
+        version = await get_dataset_version(session, "map_data")
+        cache_key = (name, assets)
+
+        if version is not None and cache_key in map_cache and map_cache[cache_key][0] == version:
+            return await cached_response(map_cache[cache_key][1], if_none_match, accept_encoding)
+
+        async def build_entry() -> Optional[CachedResponse]:
+            async with AsyncSessionLocal() as query_session:
+                # The figure is stored as a JSON string, #>> unwraps it into the figure JSON text
+                result = await query_session.execute(
+                    text("SELECT map_json #>> '{}' FROM map_data WHERE name = :name;"), {"name": name}
+                )
+                map_json = result.scalar_one_or_none()
+
+                if map_json is None:
+                    return None
+
+                body = map_json.encode()
+
+                if assets == "embed" and '"$asset"' in map_json:
+                    figure = orjson.loads(body)
+                    asset_bodies = {
+                        asset: (await load_map_asset(query_session, *asset)).body for asset in find_map_assets(figure)
+                    }
+                    body = embed_map_assets(figure, asset_bodies)
+
+            entry = CachedResponse(body, "application/json", make_etag(body))
+
+            if version is not None:
+                map_cache[cache_key] = (version, entry)
+
+            return entry
+
+        # Identical concurrent requests share one query. The request's connection is released while it runs.
+        await session.close()
+        entry = await single_flight.run(("map", name, assets, version), build_entry)
+        if entry is None:
+            raise HTTPException(status_code = 404, detail = "Map data not found")
+
+        return await cached_response(entry, if_none_match, accept_encoding)
+
+async def load_map_asset(session: AsyncSession, name: str, version: str) -> CachedResponse:
+    """
+    Returns the cache entry holding the GeoJSON text of a map asset. Assets never change once published, so they are cached 
+    until evicted.
+    """
+    cache_key = ("map_asset", name, version)
+    entry = response_cache.get(cache_key)
+
+    if entry is None:
+        result = await session.execute(
+            text("SELECT asset_json::text FROM map_assets WHERE name = :name AND version = :version;"), 
+            {"name": name, "version": version}
+        )
+        asset_json = result.scalar_one_or_none()
+        if asset_json is None:
+            raise HTTPException(status_code = 404, detail = "Map asset not found")
+
+        body = asset_json.encode()
+        entry = CachedResponse(body, GEOJSON_MEDIA_TYPE, make_etag(body), {"Cache-Control": "public, max-age=31536000, immutable"})
+        response_cache.set(cache_key, entry)
+
+    return entry
+
+async def fetch_map_asset(db: AsyncSession, name: str, version: str, if_none_match: Optional[str], accept_encoding: Optional[str]):
+    """
+    Fetches a map asset published by the Data Pipeline. The version is part of the URL and is derived from 
+    the content of the asset, so responses are marked immutable.
+    """
     async with db as session:
-        result = await db.execute(text("SELECT * FROM excluded_postal_codes_gdf;"))
-        result_list = result.mappings().all()
-        return result_list
+        entry = await load_map_asset(session, name, version)
+        return await cached_response(entry, if_none_match, accept_encoding)
 
 # Define the routes for the FastAPI app
 @app.get("/building_permits")
-async def get_building_permits(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM building_permits;"))
-        result_list = result.mappings().all()
-        return result_list        
+async def get_building_permits(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "building_permits", params)
 
 @app.get("/combined_boundaries_and_profile_data")
-async def get_combined_boundaries_and_profile_data(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    result_list = await fetch_combined_boundaries_and_profile_data(db)
-    return result_list
+async def get_combined_boundaries_and_profile_data(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "combined_boundaries_and_profile_data", params)
 
 @app.get("/community_crime_statistics")
-async def get_community_crime_statistics(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM community_crime_statistics;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_community_crime_statistics(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "community_crime_statistics", params)
+
 @app.get("/community_disorder_statistics")
-async def get_community_disorder_statistics(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM community_disorder_statistics;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_community_disorder_statistics(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "community_disorder_statistics", params)
+
 @app.get("/community_district_boundaries")
-async def get_community_district_boundaries(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM community_district_boundaries;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_community_district_boundaries(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "community_district_boundaries", params)
+
 @app.get("/community_profiles")
-async def get_community_profiles(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM community_profiles;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_community_profiles(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "community_profiles", params)
+
 @app.get("/community_services")
-async def get_community_services(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM community_services;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_community_services(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "community_services", params)
+
 @app.get("/current_year_property_assessments")
-async def get_current_year_property_assessments(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM current_year_property_assessments;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_current_year_property_assessments(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "current_year_property_assessments", params)
+
 @app.get("/development_permits")
-async def get_development_permits(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM development_permits;"))
-        result_list = result.mappings().all()
-        return result_list
+async def get_development_permits(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "development_permits", params)
 
 @app.get("/excluded_communities")
-async def get_excluded_communities(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    result_list = await fetch_exclude_communities_gdf(db)
-    return result_list
+async def get_excluded_communities(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "excluded_communities_gdf", params)
 
 @app.get("/excluded_postal_codes")
-async def get_excluded_postal_codes(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):  
-    result_list = await fetch_exclude_postal_codes_gdf(db)
-    return result_list
-    
+async def get_excluded_postal_codes(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "excluded_postal_codes_gdf", params)
+
 @app.get("/land_use_districts")
-async def get_land_use_districts(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM land_use_districts;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_land_use_districts(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "land_use_districts", params)
+
 @app.get("/land_use_districts_info")
-async def get_land_use_districts_info(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM land_use_districts_info;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_land_use_districts_info(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "land_use_districts_info", params)
+
 @app.get("/postal_boundaries")
-async def get_postal_boundaries(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM postal_boundaries;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_postal_boundaries(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "postal_boundaries", params)
+
 @app.get("/postal_codes_with_assessed_values")
-async def get_postal_codes_with_assessed_values(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    result_list = await fetch_postal_codes_with_assessed_values(db)
-    return result_list
-    
+async def get_postal_codes_with_assessed_values(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "postal_codes_with_assessed_values", params)
+
 @app.get("/schools")
-async def get_schools(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM schools;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_schools(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "schools", params)
+
 @app.get("/transit_stops")
-async def get_transit_stops(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM ne_transit_stops_gdf;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_transit_stops(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "ne_transit_stops_gdf", params)
+
 @app.get("/vacant_apartments")
-async def get_vacant_apartments(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT * FROM vacant_apartments;"))
-        result_list = result.mappings().all()
-        return result_list
-    
+async def get_vacant_apartments(params: TableQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_table(db, "vacant_apartments", params)
+
+@app.get("/aggregate/{table}")
+async def get_aggregate(table: str, params: AggregateQueryParams = Depends(), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_aggregate(db, table, params)
+
+@app.get("/tiles/{layer}/{z}/{x}/{y}.mvt")
+async def get_tile(
+    layer: str, 
+    z: int = Path(ge = 0, le = MAX_TILE_ZOOM), 
+    x: int = Path(ge = 0), 
+    y: int = Path(ge = 0), 
+    if_none_match: Optional[str] = Header(None), 
+    accept_encoding: Optional[str] = Header(None), 
+    db: AsyncSession = Depends(get_db_session), 
+    api_key: str = Security(get_api_key)
+):
+    return await fetch_tile(db, layer, z, x, y, if_none_match, accept_encoding)
+
 @app.get("/maps/congestion")
-async def get_congestion_map(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT map_json FROM map_data WHERE name = :name"), {"name": "congestion_map"})        
-        map_data = result.scalar_one_or_none()
-        if map_data is None:
-            return HTTPException(status_code = 404, detail = "Map data not found")
-        return json.loads(map_data)
+async def get_congestion_map(assets: Literal["embed", "reference"] = Query("embed"), if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_map(db, "congestion_map", assets, if_none_match, accept_encoding)
 
 @app.get("/maps/housing_development_zone")
-async def get_housing_development_zone_map(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT map_json FROM map_data WHERE name = :name"), {"name": "housing_development_zone_map"})        
-        map_data = result.scalar_one_or_none()
-        if map_data is None:
-            return HTTPException(status_code = 404, detail = "Map data not found")
-        return json.loads(map_data)
-    
+async def get_housing_development_zone_map(assets: Literal["embed", "reference"] = Query("embed"), if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_map(db, "housing_development_zone_map", assets, if_none_match, accept_encoding)
+
 @app.get("/maps/property_value_per_community")
-async def get_property_value_per_community_map(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT map_json FROM map_data WHERE name = :name"), {"name": "property_value_per_community_map"})        
-        map_data = result.scalar_one_or_none()
-        if map_data is None:
-            return HTTPException(status_code = 404, detail = "Map data not found")
-        return json.loads(map_data)
-    
-@app.get("/maps/vacancy_per_community")
-async def get_vacancy_per_community_map(db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    async with db as session:
-        result = await session.execute(text("SELECT map_json FROM map_data WHERE name = :name"), {"name": "vacancy_per_community_map"})        
-        map_data = result.scalar_one_or_none()
-        if map_data is None:
-            return HTTPException(status_code = 404, detail = "Map data not found")
-        return json.loads(map_data)
+async def get_property_value_per_community_map(assets: Literal["embed", "reference"] = Query("embed"), if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_map(db, "property_value_per_community_map", assets, if_none_match, accept_encoding)
 
-@app.post("/api/kmeans_postal")
-async def get_kmeans_postal(model: KMeansPostalModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "postal")
-
-    kmeans_postal = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
-
-    postal_dataset = await fetch_postal_codes_with_assessed_values(db)
-    postal_df = pd.DataFrame(postal_dataset)
-    postal_df["geometry"] = postal_df["geometry"].apply(wkb_to_wkt)
-    postal_gdf = gpd.GeoDataFrame(postal_df, geometry = "geometry", crs = "EPSG:4326")
-    postal_gdf_selected_features = postal_gdf[selected_features]
-
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(postal_gdf_selected_features)
-    kmeans_postal.fit(scaled_data)
-
-    postal_gdf["KMeans Postal Cluster"] = kmeans_postal.labels_
-
-    excluded_postal_codes = await fetch_exclude_postal_codes_gdf
-    excluded_postal_codes_df = pd.DataFrame(excluded_postal_codes)
-    excluded_postal_codes_df["geometry"] = excluded_postal_codes_df["geometry"].apply(wkb_to_wkt)
-    excluded_postal_codes_gdf = gpd.GeoDataFrame(excluded_postal_codes_df, geometry = "geometry", crs = "EPSG:4326")
-
-    fig = px.choropleth_mapbox(
-        postal_gdf,
-        geojson = postal_gdf.geometry,
-        locations = postal_gdf.index,
-        color = "KMeans Postal Cluster",
-        color_continuous_scale = px.colors.qualitative.Vivid,
-        hover_name = "Community Name",
-        title = "Calgary Postal Codes by K-Means Cluster",
-        center = MAP_CENTER,
-        zoom = MAP_ZOOM,
-        opacity = 0.5,
-        mapbox_style = "carto-positron"
-    )
+@app.get("/maps/vacancy_per_community")
+async def get_vacancy_per_community_map(assets: Literal["embed", "reference"] = Query("embed"), if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_map(db, "vacancy_per_community_map", assets, if_none_match, accept_encoding)
 
-    excluded_postal_codes_geojson = json.loads(excluded_postal_codes_gdf.geometry.to_json())
+@app.get("/map_assets/{name}/{version}")
+async def get_map_asset(name: str, version: str, if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None), db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
+    return await fetch_map_asset(db, name, version, if_none_match, accept_encoding)
 
-    excluded_postal_codes_layer = go.Choroplethmapbox(
-        geojson = excluded_postal_codes_geojson,
-        locations = excluded_postal_codes_gdf.index,
-        z = [1] * len(excluded_postal_codes_gdf),
-        colorscale = ["#AAAAAA", "#AAAAAA"],
-        showscale = False,
-        hoverinfo = "text",
-    )
-    
-    fig.add_trace(excluded_postal_codes_layer)
+async def compute_kmeans_postal(model: KMeansPostalModelInput):
+    snapshot, _, fit = await get_clustering_fit("postal", model)
+    return await clustering_pool.run(snapshot, cluster_map, fit.labels)
 
-    return fig.to_json()
+@app.post("/api/kmeans_postal")
+async def get_kmeans_postal(model: KMeansPostalModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_postal", model, compute_kmeans_postal)
 
+async def compute_kmeans_community(model: KMeansCommunityModelInput):
+    snapshot, _, fit = await get_clustering_fit("community", model)
+    return await clustering_pool.run(snapshot, cluster_map, fit.labels)
 
 @app.post("/api/kmeans_community")
-async def get_kmeans_community(model: KMeansCommunityModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "community")
-    kmeans_community = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
-
-    community_dataset = await fetch_combined_boundaries_and_profile_data(db)
-    community_df = pd.DataFrame(community_dataset)
-    community_df["geometry"] = community_df["geometry"].apply(wkb_to_wkt)
-    community_gdf = gpd.GeoDataFrame(community_df, geometry = "geometry", crs = "EPSG:4326")
-    community_gdf_selected_features = community_gdf[selected_features]
-
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(community_gdf_selected_features)
-    kmeans_community.fit(scaled_data)
-
-    community_gdf["KMeans Community Cluster"] = kmeans_community.labels_
-
-    excluded_communities = await fetch_exclude_communities_gdf(db)
-    excluded_communities_df = pd.DataFrame(excluded_communities)
-    excluded_communities_df["geometry"] = excluded_communities_df["geometry"].apply(wkb_to_wkt)
-    excluded_communities_gdf = gpd.GeoDataFrame(excluded_communities_df, geometry = "geometry", crs = "EPSG:4326")
-
-    fig = px.choropleth_mapbox(
-        community_gdf,
-        geojson = community_gdf.geometry,
-        locations = community_gdf.index,
-        color = "KMeans Community Cluster",
-        color_continuous_scale = px.colors.qualitative.Vivid,
-        hover_name = "Community Name",
-        title = "Calgary Communities by K-Means Cluster",
-        center = MAP_CENTER,
-        zoom = MAP_ZOOM,
-        opacity = 0.5,
-        mapbox_style = "carto-positron"
-    )
-
-    excluded_communities_geojson = json.loads(excluded_communities_gdf.geometry.to_json())
-
-    excluded_communities_layer = go.Choroplethmapbox(
-        geojson = excluded_communities_geojson,
-        locations = excluded_communities_gdf.index,
-        z = [1] * len(excluded_communities_gdf),
-        colorscale = ["#AAAAAA", "#AAAAAA"],
-        showscale = False,
-        hoverinfo = "text",
-    )
-    
-    fig.add_trace(excluded_communities_layer)
+async def get_kmeans_community(model: KMeansCommunityModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_community", model, compute_kmeans_community)
 
-    return fig.to_json()
+async def compute_kmeans_postal_info(model: KMeansPostalModelInput):
+    snapshot, selected_features, fit = await get_clustering_fit("postal", model)
+    return await clustering_pool.run(snapshot, cluster_info, selected_features, fit.labels)
 
 @app.post("/api/kmeans_postal_info")
-async def get_kmeans_postal_info(model: KMeansPostalModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "postal")
+async def get_kmeans_postal_info(model: KMeansPostalModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_postal_info", model, compute_kmeans_postal_info)
 
-    kmeans_postal = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
+async def compute_kmeans_community_info(model: KMeansCommunityModelInput):
+    snapshot, selected_features, fit = await get_clustering_fit("community", model)
+    return await clustering_pool.run(snapshot, cluster_info, selected_features, fit.labels)
 
-    postal_dataset = await fetch_postal_codes_with_assessed_values(db)
-    postal_df = pd.DataFrame(postal_dataset)
-    postal_df["geometry"] = postal_df["geometry"].apply(wkb_to_wkt)
-    postal_gdf = gpd.GeoDataFrame(postal_df, geometry = "geometry", crs = "EPSG:4326")
-    postal_gdf_selected_features = postal_gdf[selected_features]
+@app.post("/api/kmeans_community_info")
+async def get_kmeans_community_info(model: KMeansCommunityModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_community_info", model, compute_kmeans_community_info)
 
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(postal_gdf_selected_features)
-    kmeans_postal.fit(scaled_data)
+async def compute_kmeans_postal_info_full(model: KMeansPostalModelInput):
+    snapshot, selected_features, fit = await get_clustering_fit("postal", model)
+    return await clustering_pool.run(snapshot, cluster_info_full, selected_features, fit.labels)
 
-    postal_gdf["KMeans Postal Cluster"] = kmeans_postal.labels_
-    postal_gdf_selected_features = postal_gdf.select_dtypes(include = [np.number])
-    postal_gdf_selected_features = postal_gdf_selected_features[selected_features + ["KMeans Postal Cluster"]]
+@app.post("/api/kmeans_postal_info_full")
+async def get_kmeans_postal_info_full(model: KMeansPostalModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_postal_info_full", model, compute_kmeans_postal_info_full)
 
-    result = postal_gdf_selected_features.groupby("KMeans Postal Cluster").mean().reset_index()
-    return result.to_json(orient = "records")
+async def compute_kmeans_community_info_full(model: KMeansCommunityModelInput):
+    snapshot, selected_features, fit = await get_clustering_fit("community", model)
+    return await clustering_pool.run(snapshot, cluster_info_full, selected_features, fit.labels)
 
-@app.post("/api/kmeans_community_info")
-async def get_kmeans_community_info(model: KMeansCommunityModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "community")
-    kmeans_community = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
+@app.post("/api/kmeans_community_info_full")
+async def get_kmeans_community_info_full(model: KMeansCommunityModelInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_community_info_full", model, compute_kmeans_community_info_full)
 
-    community_dataset = await fetch_combined_boundaries_and_profile_data(db)
-    community_df = pd.DataFrame(community_dataset)
-    community_df["geometry"] = community_df["geometry"].apply(wkb_to_wkt)
-    community_gdf = gpd.GeoDataFrame(community_df, geometry = "geometry", crs = "EPSG:4326")
-    community_gdf_selected_features = community_gdf[selected_features]
+async def compute_kmeans_artifacts(dataset: str, model) -> bytes:
+    """
+    Builds the clustering artifacts selected by the model from one fit. The artifacts are independent, 
+    so they are built concurrently in the clustering worker processes. Returns a JSON object with one 
+    member per artifact.
+    """
+    snapshot, selected_features, fit = await get_clustering_fit(dataset, model)
 
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(community_gdf_selected_features)
-    kmeans_community.fit(scaled_data)
+    builders = {
+        "map": lambda: clustering_pool.run(snapshot, cluster_map, fit.labels),
+        "info": lambda: clustering_pool.run(snapshot, cluster_info, selected_features, fit.labels),
+        "info_full": lambda: clustering_pool.run(snapshot, cluster_info_full, selected_features, fit.labels),
+    }
 
-    community_gdf["KMeans Community Cluster"] = kmeans_community.labels_
-    community_gdf_selected_features = community_gdf.select_dtypes(include = [np.number])
-    community_gdf_selected_features = community_gdf_selected_features[selected_features + ["KMeans Community Cluster"]]
+    artifacts = list(dict.fromkeys(model.artifacts))
+    results = await asyncio.gather(*(builders[artifact]() for artifact in artifacts))
 
-    result = community_gdf_selected_features.groupby("KMeans Community Cluster").mean().reset_index()
-    return result.to_json(orient = "records")
+    # The artifacts are already serialized, so they are embedded as they are
+    return orjson.dumps({artifact: orjson.Fragment(result) for artifact, result in zip(artifacts, results)})
 
-@app.post("/api/kmeans_postal_info_full")
-async def get_kmeans_postal_info_full(model: KMeansPostalModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "postal")
+async def compute_kmeans_postal_artifacts(model: KMeansPostalArtifactsInput):
+    return await compute_kmeans_artifacts("postal", model)
 
-    kmeans_postal = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
+@app.post("/api/kmeans_postal_artifacts")
+async def get_kmeans_postal_artifacts(model: KMeansPostalArtifactsInput, api_key: str = Security(get_api_key)):
+    body = await run_clustering("kmeans_postal_artifacts", model, compute_kmeans_postal_artifacts)
+    return Response(content = body, media_type = "application/json")
 
-    postal_dataset = await fetch_postal_codes_with_assessed_values(db)
-    postal_df = pd.DataFrame(postal_dataset)
-    postal_df["geometry"] = postal_df["geometry"].apply(wkb_to_wkt)
-    postal_gdf = gpd.GeoDataFrame(postal_df, geometry = "geometry", crs = "EPSG:4326")
-    postal_gdf_selected_features = postal_gdf[selected_features]
+async def compute_kmeans_community_artifacts(model: KMeansCommunityArtifactsInput):
+    return await compute_kmeans_artifacts("community", model)
 
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(postal_gdf_selected_features)
-    kmeans_postal.fit(scaled_data)
+@app.post("/api/kmeans_community_artifacts")
+async def get_kmeans_community_artifacts(model: KMeansCommunityArtifactsInput, api_key: str = Security(get_api_key)):
+    body = await run_clustering("kmeans_community_artifacts", model, compute_kmeans_community_artifacts)
+    return Response(content = body, media_type = "application/json")
 
-    postal_gdf["KMeans Postal Cluster"] = kmeans_postal.labels_
-    postal_code_count_by_community_and_clusters = postal_gdf.groupby(["Community Name", "KMeans Postal Cluster"])[selected_features].agg(["mean", "median", "std"])
+async def compute_kmeans_sweep(dataset: str, model) -> List[dict]:
+    """
+    Clusters the features selected by the model for every number of clusters from min_clusters to max_clusters 
+    and scores each result with the silhouette coefficient, the Calinski-Harabasz index and the Davies-Bouldin 
+    index. Each number of clusters runs as its own task, so they run in parallel across the clustering worker 
+    processes, and each worker standardizes the selected features once.
+    """
+    snapshot = await get_clustering_snapshot(dataset)
+    selected_features = get_selected_features(model, dataset)
 
-    return postal_code_count_by_community_and_clusters.to_json(orient = "records")
+    try:
+        return await asyncio.gather(*(
+            clustering_pool.run(
+                snapshot, evaluate_n_clusters, selected_features, n_clusters, model.random_state, model.algorithm, 
+                model.sample_size, model.max_iter, model.time_budget, model.silhouette_sample_size
+            )
+            for n_clusters in range(model.min_clusters, model.max_clusters + 1)
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code = 400, detail = str(e))
 
-@app.post("/api/kmeans_community_info_full")
-async def get_kmeans_community_info_full(model: KMeansCommunityModelInput, db: AsyncSession = Depends(get_db_session), api_key: str = Security(get_api_key)):
-    selected_features = get_selected_features(model, "community")
-    kmeans_community = KMeans(n_clusters = model.n_clusters, random_state = model.random_state)
+async def compute_kmeans_postal_sweep(model: KMeansPostalSweepInput):
+    return await compute_kmeans_sweep("postal", model)
 
-    community_dataset = await fetch_combined_boundaries_and_profile_data(db)
-    community_df = pd.DataFrame(community_dataset)
-    community_df["geometry"] = community_df["geometry"].apply(wkb_to_wkt)
-    community_gdf = gpd.GeoDataFrame(community_df, geometry = "geometry", crs = "EPSG:4326")
-    community_gdf_selected_features = community_gdf[selected_features]
+@app.post("/api/kmeans_postal_sweep")
+async def get_kmeans_postal_sweep(model: KMeansPostalSweepInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_postal_sweep", model, compute_kmeans_postal_sweep)
 
-    scaler = StandardScaler()
-    scaled_data = scaler.fit_transform(community_gdf_selected_features)
-    kmeans_community.fit(scaled_data)
+async def compute_kmeans_community_sweep(model: KMeansCommunitySweepInput):
+    return await compute_kmeans_sweep("community", model)
 
-    community_gdf["KMeans Community Cluster"] = kmeans_community.labels_
-    postal_code_count_by_community_and_clusters = community_gdf.groupby(["Community Name", "KMeans Community Cluster"])[selected_features].agg(["mean", "median", "std"])
+@app.post("/api/kmeans_community_sweep")
+async def get_kmeans_community_sweep(model: KMeansCommunitySweepInput, api_key: str = Security(get_api_key)):
+    return await run_clustering("kmeans_community_sweep", model, compute_kmeans_community_sweep)
 
-    return postal_code_count_by_community_and_clusters.to_json(orient = "records")
+@app.get("/metrics/clustering")
+async def get_clustering_metrics(api_key: str = Security(get_api_key)):
+    return clustering_admission.metrics()
 
 # Run the FastAPI app
 if __name__ == "__main__":
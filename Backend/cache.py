@@ -0,0 +1,342 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+import asyncpg
+import brotli
+from fastapi import Response
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Compression levels. Each body is compressed at most once per encoding and dataset version, so 
+# the levels favour size over speed.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# Supported content codings, in order of preference
+ENCODINGS = ("br", "gzip")
+
+@dataclass
+class CachedResponse:
+    """
+    A serialized response body together with its strong ETag and any extra headers. Compressed variants 
+    of the body are created on first use and kept with the entry, so they live exactly as long as the 
+    dataset version they were built from.
+
+    Compression runs in a worker thread, so large bodies do not block the event loop, and requests that 
+    arrive while a variant is being compressed wait for that compression instead of starting another. 
+    on_encoded is called with the size of each new variant, so the cache holding the entry can count it.
+    """
+    body: bytes
+    media_type: str
+    etag: str
+    headers: Dict[str, str] = field(default_factory = dict)
+    compressible: bool = True
+    encoded: Dict[str, bytes] = field(default_factory = dict)
+    encoding_tasks: Dict[str, asyncio.Future] = field(default_factory = dict)
+    on_encoded: Optional[Callable[[int], None]] = field(default = None, repr = False)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.body) + sum(len(variant) for variant in self.encoded.values())
+
+    def compress(self, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(self.body, quality = BROTLI_QUALITY)
+        return gzip.compress(self.body, compresslevel = GZIP_LEVEL, mtime = 0)
+
+    async def encode(self, encoding: str) -> bytes:
+        if encoding not in self.encoded:
+            task = self.encoding_tasks.get(encoding)
+            if task is None:
+                task = asyncio.ensure_future(asyncio.to_thread(self.compress, encoding))
+                self.encoding_tasks[encoding] = task
+
+            # A client disconnecting must not cancel the compression the other requests are waiting on
+            try:
+                variant = await asyncio.shield(task)
+            finally:
+                if task.done():
+                    self.encoding_tasks.pop(encoding, None)
+
+            # Every waiting request resumes here, but only the first stores and reports the variant
+            if encoding not in self.encoded:
+                self.encoded[encoding] = variant
+                if self.on_encoded is not None:
+                    self.on_encoded(len(variant))
+        return self.encoded[encoding]
+
+def make_etag(body: bytes) -> str:
+    """
+    Creates a strong ETag from the bytes of a response body.
+
+    body: The serialized response body.
+    """
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Checks an If-None-Match header against an ETag. If-None-Match uses the weak comparison, so a W/ prefix is ignored.
+
+    if_none_match: The If-None-Match header sent by the client.
+    etag: The ETag of the current representation.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Picks the preferred supported content coding from an Accept-Encoding header, or None for the identity coding.
+
+    accept_encoding: The Accept-Encoding header sent by the client.
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+
+    for part in accept_encoding.split(","):
+        coding, _, parameters = part.partition(";")
+        quality = 1.0
+        parameter_name, _, parameter_value = parameters.partition("=")
+        if parameter_name.strip().lower() == "q":
+            try:
+                quality = float(parameter_value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+
+    return None
+
+async def cached_response(entry: CachedResponse, if_none_match: Optional[str] = None, accept_encoding: Optional[str] = None) -> Response:
+    """
+    Builds the response for a cache entry, compressed with the coding preferred by the client. 
+    Returns 304 Not Modified if the client already has the current representation.
+
+    entry: The cache entry to send.
+    if_none_match: The If-None-Match header sent by the client.
+    accept_encoding: The Accept-Encoding header sent by the client.
+    """
+    compress = entry.compressible and len(entry.body) >= MIN_COMPRESS_SIZE
+    encoding = choose_encoding(accept_encoding) if compress else None
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding", **entry.headers}
+
+    # Each coding is a different representation, so it needs its own strong ETag
+    etag = entry.etag if encoding is None else entry.etag[:-1] + "-" + encoding + '"'
+    headers["ETag"] = etag
+
+    if etag_matches(if_none_match, etag):
+        return Response(status_code = 304, headers = headers)
+
+    if encoding is None:
+        return Response(content = entry.body, media_type = entry.media_type, headers = headers)
+
+    headers["Content-Encoding"] = encoding
+    return Response(content = await entry.encode(encoding), media_type = entry.media_type, headers = headers)
+
+class ResponseCache:
+    """
+    In-process LRU cache of serialized responses.
+
+    Keys include the version of the dataset a response was built from, so entries built before a pipeline
+    run are never served again and simply age out. The cache is bounded by both entry count and total size 
+    of the bodies, including the compressed variants created after an entry was stored.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key: Hashable, entry: CachedResponse):
+        if entry.nbytes > self.max_bytes:
+            return
+
+        self.discard(key)
+        self.entries[key] = entry
+        self.size += entry.nbytes
+        entry.on_encoded = lambda variant_size: self.grow(key, entry, variant_size)
+        self.evict()
+
+    def grow(self, key: Hashable, entry: CachedResponse, variant_size: int):
+        # The entry may have been evicted or replaced while the variant was being compressed
+        if self.entries.get(key) is not entry:
+            return
+
+        self.size += variant_size
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last = False)
+            evicted.on_encoded = None
+            self.size -= evicted.nbytes
+
+    def discard(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            entry.on_encoded = None
+            self.size -= entry.nbytes
+
+    def discard_where(self, predicate: Callable[[Hashable], bool]):
+        for key in [key for key in self.entries if predicate(key)]:
+            self.discard(key)
+
+class LRUCache:
+    """
+    In-process cache of arbitrary values, bounded by entry count. The least recently used entry is evicted first.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical computations. The first caller for a key starts the computation and 
+    every caller that arrives while it is in flight awaits the same result, or the same exception.
+
+    The computation runs as its own task and is shielded from the callers, so a client disconnecting does 
+    not cancel the work the other callers are waiting on. Computations must therefore not use a database 
+    session owned by a request.
+    """
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        task = self.calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+
+        # Retrieve the exception so it is not reported as unhandled if every caller has gone away
+        if not task.cancelled():
+            task.exception()
+
+class DatasetVersionListener:
+    """
+    Keeps the latest version of each dataset in memory by listening on the channel the Data Pipeline 
+    notifies when it records a new version. Each notification updates the version and calls on_change 
+    with the table name, so caches built from the previous data are dropped as soon as the pipeline commits.
+
+    Versions are only served from memory while the listener is connected. Notifications sent while it is 
+    disconnected are lost, so the known versions are dropped on disconnect and callers go back to reading 
+    them from the database until the listener has reconnected.
+    """
+    def __init__(
+        self, 
+        connect: Callable[[], Awaitable[asyncpg.Connection]], 
+        channel: str, 
+        on_change: Callable[[str], None], 
+        reconnect_delay: float,
+        health_check_interval: float
+    ):
+        self.connect = connect
+        self.channel = channel
+        self.on_change = on_change
+        self.reconnect_delay = reconnect_delay
+        self.health_check_interval = health_check_interval
+        self.versions = {}
+        self.connected = False
+
+    def get(self, table_name: str) -> Tuple[bool, Optional[str]]:
+        """
+        Returns whether the version of a table is known, and the version.
+        """
+        if not self.connected or table_name not in self.versions:
+            return False, None
+        return True, self.versions[table_name]
+
+    def remember(self, table_name: str, version: Optional[str]):
+        """
+        Stores a version read from the database. A version received by notification in the meantime is newer, 
+        so it is kept.
+        """
+        if self.connected:
+            self.versions.setdefault(table_name, version)
+
+    def _notify(self, connection, pid, channel, payload):
+        try:
+            notification = json.loads(payload)
+            table_name = notification["table_name"]
+            version = notification["version"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed dataset version notification: {payload}")
+            return
+
+        self.versions[table_name] = version
+        self.on_change(table_name)
+
+    async def run(self):
+        while True:
+            connection = None
+            try:
+                connection = await self.connect()
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(self.channel, self._notify)
+
+                # Anything may have changed while the listener was disconnected
+                self.versions.clear()
+                self.connected = True
+                logger.info(f"Listening for dataset versions on channel '{self.channel}'.")
+
+                # A connection that died without closing cleanly is only noticed when it is used
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout = self.health_check_interval)
+                    except asyncio.TimeoutError:
+                        await connection.fetchval("SELECT 1;")
+
+                logger.warning("Dataset version listener connection closed.")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Dataset version listener failed.")
+            finally:
+                self.connected = False
+                self.versions.clear()
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+            await asyncio.sleep(self.reconnect_delay)
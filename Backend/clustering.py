@@ -0,0 +1,527 @@
+import asyncio
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import lru_cache
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.express as px
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+from utils import community_features_dict, evaluate_clustering_performance, postal_features_dict, wkb_to_wkt
+
+# Define the map constants
+MAP_ZOOM = 9
+MAP_CENTER = {"lat": 51.096, "lon": -113.954}
+
+# Define the datasets the clustering routes work on: the table of each, the table of the areas excluded
+# from clustering, the column that identifies a row, the feature columns and how clusters are labelled
+CLUSTERING_DATASETS = {
+    "postal": {
+        "table": "postal_codes_with_assessed_values",
+        "excluded_table": "excluded_postal_codes_gdf",
+        "key": "Postal Code",
+        "features": list(postal_features_dict),
+        "cluster_column": "KMeans Postal Cluster",
+        "title": "Calgary Postal Codes by K-Means Cluster",
+    },
+    "community": {
+        "table": "combined_boundaries_and_profile_data",
+        "excluded_table": "excluded_communities_gdf",
+        "key": "Community Name",
+        "features": list(community_features_dict),
+        "cluster_column": "KMeans Community Cluster",
+        "title": "Calgary Communities by K-Means Cluster",
+    },
+}
+
+@dataclass
+class ClusteringSnapshot:
+    """
+    A clustering dataset held in memory for one version of its tables. Rows are sorted by the key column,
+    so row positions are stable for a given version. Feature columns are stored once as a column-major
+    float64 matrix, so a request only slices the columns it selected. Geometries are decoded once, and the
+    GeoJSON of the excluded areas is prepared once for the maps.
+
+    The snapshot is kept compact because it is sent to the clustering worker processes: gdf only holds the
+    key column, the community name and the displayed geometry, and the excluded areas are only kept as GeoJSON.
+    """
+    dataset: str
+    version: Tuple[Optional[str], Optional[str]]
+    gdf: gpd.GeoDataFrame
+    feature_columns: List[str]
+    features: np.ndarray
+    excluded_geojson: dict
+
+    def select(self, selected_features: Sequence[str]) -> np.ndarray:
+        """
+        Returns the columns of the selected features, in the order they were selected.
+
+        selected_features: The names of the feature columns.
+        """
+        missing_features = [feature for feature in selected_features if feature not in self.feature_columns]
+        if missing_features:
+            raise ValueError(f"Unknown features: {', '.join(missing_features)}")
+        return self.features[:, [self.feature_columns.index(feature) for feature in selected_features]]
+
+def rows_to_gdf(rows: Sequence[Mapping]) -> gpd.GeoDataFrame:
+    """
+    Builds a GeoDataFrame from query results with a hex WKB geometry column.
+
+    rows: The rows returned by the query.
+    """
+    df = pd.DataFrame(rows)
+    df["geometry"] = df["geometry"].apply(wkb_to_wkt)
+    return gpd.GeoDataFrame(df, geometry = "geometry", crs = "EPSG:4326")
+
+def build_snapshot(
+    dataset: str,
+    version: Tuple[Optional[str], Optional[str]],
+    rows: Sequence[Mapping],
+    excluded_rows: Sequence[Mapping]
+) -> ClusteringSnapshot:
+    """
+    Builds the in-memory snapshot of a clustering dataset.
+
+    dataset: The name of the dataset, "postal" or "community".
+    version: The versions of the dataset table and of its excluded areas table.
+    rows: The rows of the dataset table.
+    excluded_rows: The rows of the excluded areas table.
+    """
+    dataset_info = CLUSTERING_DATASETS[dataset]
+
+    df = pd.DataFrame(rows).sort_values(dataset_info["key"], kind = "stable").reset_index(drop = True)
+    feature_columns = [feature for feature in dataset_info["features"] if feature in df.columns]
+    features = np.asfortranarray(df[feature_columns].to_numpy(dtype = np.float64))
+
+    # Every other column, such as the 1 KM buffer geometry of the postal codes, is dropped before decoding
+    display_columns = list(dict.fromkeys([dataset_info["key"], "Community Name", "geometry"]))
+    gdf = rows_to_gdf(df[display_columns])
+
+    excluded_geojson = json.loads(rows_to_gdf(excluded_rows).geometry.to_json())
+
+    return ClusteringSnapshot(dataset, version, gdf, feature_columns, features, excluded_geojson)
+
+# Define the number of rows in each mini-batch of the mini-batch engine
+MINIBATCH_SIZE = 1024
+
+# The snapshots loaded by a clustering worker process, keyed by the path of the file they were loaded from
+worker_snapshots = {}
+
+def start_worker():
+    """
+    Does nothing. Submitted once per worker when the pool starts, so the worker processes are spawned and 
+    have imported this module before the first clustering request.
+    """
+
+def write_snapshot(snapshot: ClusteringSnapshot, path: str):
+    """
+    Writes a snapshot to the file the worker processes load it from.
+
+    snapshot: The snapshot.
+    path: The path of the file.
+    """
+    with open(path, "wb") as file:
+        pickle.dump(snapshot, file, protocol = pickle.HIGHEST_PROTOCOL)
+
+def resolve_snapshot(snapshot: Union[str, ClusteringSnapshot]) -> ClusteringSnapshot:
+    """
+    Returns the snapshot to work on: the snapshot itself, or the one published to a file. A worker process loads 
+    each file once and only keeps the latest version of each dataset.
+
+    snapshot: A snapshot, or the path of the file a snapshot was published to.
+    """
+    if isinstance(snapshot, ClusteringSnapshot):
+        return snapshot
+
+    if snapshot not in worker_snapshots:
+        with open(snapshot, "rb") as file:
+            loaded_snapshot = pickle.load(file)
+
+        for path in [path for path, held in worker_snapshots.items() if held.dataset == loaded_snapshot.dataset]:
+            del worker_snapshots[path]
+        worker_snapshots[snapshot] = loaded_snapshot
+
+    return worker_snapshots[snapshot]
+
+class ClusteringPool:
+    """
+    Runs the CPU-bound clustering work in worker processes, so it does not block the event loop.
+
+    Published snapshots are written once to a file per dataset version, and a task only sends the path of the 
+    file, the selected features and the labels. Workers load a snapshot from its file the first time a task 
+    needs it, so a new dataset version does not restart them. Snapshots that were not published, such as those 
+    of tables without a recorded version, are sent with the task instead.
+
+    Submitting work spawns a worker process when none is idle, so work is always submitted from a thread, and 
+    start() spawns every worker before the first request.
+    """
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self.snapshots = {}
+        self.snapshot_paths = {}
+        self.snapshot_directory = None
+        self.executor = None
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers = self.max_workers, mp_context = get_context("spawn"))
+        return self.executor
+
+    async def submit(self, executor: ProcessPoolExecutor, function: Callable[..., Any], *args) -> Any:
+        future = await asyncio.to_thread(executor.submit, function, *args)
+        return await asyncio.wrap_future(future)
+
+    async def start(self):
+        """
+        Spawns the worker processes off the event loop.
+        """
+        executor = self.get_executor()
+        await asyncio.gather(*(self.submit(executor, start_worker) for _ in range(self.max_workers)))
+
+    async def publish(self, snapshot: ClusteringSnapshot):
+        """
+        Writes a versioned snapshot to its file off the event loop. Later tasks on the snapshot send the path 
+        of the file. The file of the previous version is kept for tasks that were submitted before, older 
+        files are removed.
+
+        snapshot: The snapshot.
+        """
+        if self.snapshot_directory is None:
+            self.snapshot_directory = tempfile.mkdtemp(prefix = "clustering-snapshots-")
+
+        path = os.path.join(self.snapshot_directory, f"{snapshot.dataset}-{'-'.join(snapshot.version)}.pickle")
+        await asyncio.to_thread(write_snapshot, snapshot, path)
+
+        self.snapshots[snapshot.dataset] = snapshot
+        paths = self.snapshot_paths.setdefault(snapshot.dataset, [])
+        if path in paths:
+            paths.remove(path)
+        paths.append(path)
+        while len(paths) > 2:
+            os.remove(paths.pop(0))
+
+    async def run(self, snapshot: ClusteringSnapshot, function: Callable[..., Any], *args) -> Any:
+        """
+        Runs a module-level function of this module in a worker process. The function receives the snapshot, 
+        or the path of its file if it was published, followed by the other arguments.
+
+        snapshot: The snapshot to work on.
+        function: The function to run.
+        args: The other arguments of the function.
+        """
+        executor = self.get_executor()
+
+        if self.snapshots.get(snapshot.dataset) is snapshot:
+            snapshot = self.snapshot_paths[snapshot.dataset][-1]
+
+        try:
+            return await self.submit(executor, function, snapshot, *args)
+        except BrokenProcessPool:
+            # A worker died, which leaves the executor unusable, so later work gets fresh workers
+            if self.executor is executor:
+                self.executor = None
+                executor.shutdown(wait = False)
+            raise
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = False, cancel_futures = True)
+            self.executor = None
+        if self.snapshot_directory is not None:
+            shutil.rmtree(self.snapshot_directory, ignore_errors = True)
+            self.snapshot_directory = None
+            self.snapshot_paths = {}
+            self.snapshots = {}
+
+@dataclass
+class ClusteringFit:
+    """
+    The result of fitting K-Means to a selection of features: the cluster label of each row of the snapshot, 
+    the centroids in standardized units, and the mean and scale the features were standardized with.
+    """
+    labels: np.ndarray
+    centroids: np.ndarray
+    scaler_mean: np.ndarray
+    scaler_scale: np.ndarray
+
+def feature_mask(dataset: str, selected_features: Sequence[str]) -> int:
+    """
+    Encodes a selection of features as a bitmask over the features of the dataset, for use in cache keys.
+
+    dataset: The name of the dataset, "postal" or "community".
+    selected_features: The names of the selected features.
+    """
+    features = CLUSTERING_DATASETS[dataset]["features"]
+    return sum(1 << features.index(feature) for feature in selected_features if feature in features)
+
+def cluster_scaled(
+    scaled_data: np.ndarray, 
+    n_clusters: int, 
+    random_state: int, 
+    algorithm: str = "kmeans", 
+    sample_size: Optional[int] = None, 
+    max_iter: Optional[int] = None, 
+    time_budget: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Clusters standardized features. Returns the cluster label of each row and the centroids.
+
+    The mini-batch engine fits a random sample of the rows, stopping after max_iter mini-batches or once 
+    the time budget is spent, and then assigns every row to its nearest centroid. Its cost is bounded by 
+    the sample size, the iterations and the budget rather than the number of rows.
+
+    scaled_data: The standardized feature matrix, one row per area.
+    n_clusters: The number of clusters.
+    random_state: The seed of the sampling and of the centroid initialization.
+    algorithm: "kmeans" for K-Means on every row, or "minibatch" for the mini-batch engine.
+    sample_size: The number of rows the mini-batch engine fits on.
+    max_iter: The maximum number of mini-batches.
+    time_budget: The time the mini-batch engine may take, in seconds. At least one mini-batch is always run.
+    """
+    if algorithm != "minibatch":
+        kmeans = KMeans(n_clusters = n_clusters, random_state = random_state)
+        kmeans.fit(scaled_data)
+        return kmeans.labels_, kmeans.cluster_centers_
+
+    started_at = time.perf_counter()
+
+    random = np.random.default_rng(random_state)
+    if len(scaled_data) > sample_size:
+        sample = scaled_data[random.choice(len(scaled_data), sample_size, replace = False)]
+    else:
+        sample = scaled_data
+
+    batch_size = max(n_clusters, min(MINIBATCH_SIZE, len(sample)))
+    kmeans = MiniBatchKMeans(n_clusters = n_clusters, batch_size = batch_size, random_state = random_state, n_init = 1)
+
+    for _ in range(max_iter):
+        kmeans.partial_fit(sample[random.choice(len(sample), batch_size, replace = batch_size > len(sample))])
+        if time.perf_counter() - started_at >= time_budget:
+            break
+
+    return kmeans.predict(scaled_data), kmeans.cluster_centers_
+
+def fit_kmeans(
+    features: np.ndarray, 
+    n_clusters: int, 
+    random_state: int, 
+    algorithm: str = "kmeans", 
+    sample_size: Optional[int] = None, 
+    max_iter: Optional[int] = None, 
+    time_budget: Optional[float] = None
+) -> ClusteringFit:
+    """
+    Standardizes the features and clusters them with K-Means, or with the mini-batch engine.
+
+    features: The feature matrix, one row per area.
+    n_clusters: The number of clusters.
+    random_state: The seed of the centroid initialization.
+    algorithm: "kmeans" for K-Means on every row, or "minibatch" for the mini-batch engine.
+    sample_size: The number of rows the mini-batch engine fits on.
+    max_iter: The maximum number of mini-batches.
+    time_budget: The time the mini-batch engine may take, in seconds.
+    """
+    scaler = StandardScaler()
+    scaled_data = scaler.fit_transform(features)
+    labels, centroids = cluster_scaled(scaled_data, n_clusters, random_state, algorithm, sample_size, max_iter, time_budget)
+    return ClusteringFit(labels, centroids, scaler.mean_, scaler.scale_)
+
+def catalogue_fit(
+    snapshot: ClusteringSnapshot, 
+    labels: Mapping[str, int], 
+    centroids: List[List[float]], 
+    scaler_mean: List[float], 
+    scaler_scale: List[float]
+) -> Optional[ClusteringFit]:
+    """
+    Builds the fit of a clustering catalogue entry precomputed by the Data Pipeline. Returns None if 
+    the entry does not have a label for every row of the snapshot.
+
+    snapshot: The clustering dataset.
+    labels: The cluster label of each row, keyed by the key column of the dataset.
+    centroids: The centroids in standardized units.
+    scaler_mean: The mean the features were standardized with.
+    scaler_scale: The scale the features were standardized with.
+    """
+    row_labels = snapshot.gdf[CLUSTERING_DATASETS[snapshot.dataset]["key"]].map(labels)
+    if row_labels.isna().any():
+        return None
+
+    return ClusteringFit(
+        row_labels.to_numpy(dtype = np.int32), 
+        np.asarray(centroids, dtype = np.float64), 
+        np.asarray(scaler_mean, dtype = np.float64), 
+        np.asarray(scaler_scale, dtype = np.float64)
+    )
+
+def fit_snapshot(
+    snapshot: Union[str, ClusteringSnapshot], 
+    selected_features: List[str], 
+    n_clusters: int, 
+    random_state: int,
+    algorithm: str = "kmeans",
+    sample_size: Optional[int] = None,
+    max_iter: Optional[int] = None,
+    time_budget: Optional[float] = None
+) -> ClusteringFit:
+    """
+    Clusters the selected features of a snapshot with K-Means, or with the mini-batch engine.
+
+    snapshot: The clustering dataset, or the path of the file it was published to.
+    selected_features: The features to cluster on.
+    n_clusters: The number of clusters.
+    random_state: The seed of the centroid initialization.
+    algorithm: "kmeans" for K-Means on every row, or "minibatch" for the mini-batch engine.
+    sample_size: The number of rows the mini-batch engine fits on.
+    max_iter: The maximum number of mini-batches.
+    time_budget: The time the mini-batch engine may take, in seconds.
+    """
+    features = resolve_snapshot(snapshot).select(selected_features)
+    return fit_kmeans(features, n_clusters, random_state, algorithm, sample_size, max_iter, time_budget)
+
+@lru_cache(maxsize = 16)
+def worker_scaled_features(path: str, selected_features: Tuple[str, ...]) -> np.ndarray:
+    """
+    Returns the standardized selected features of a snapshot published to a file. A published snapshot never 
+    changes, so the matrix is reused by every task of the worker that selects the same features.
+
+    path: The path of the file the snapshot was published to.
+    selected_features: The features to standardize.
+    """
+    return StandardScaler().fit_transform(resolve_snapshot(path).select(selected_features))
+
+def evaluate_n_clusters(
+    snapshot: Union[str, ClusteringSnapshot], 
+    selected_features: List[str], 
+    n_clusters: int, 
+    random_state: int,
+    algorithm: str,
+    sample_size: int,
+    max_iter: int,
+    time_budget: float,
+    silhouette_sample_size: int
+) -> Dict[str, Any]:
+    """
+    Clusters the selected features of a snapshot into n_clusters clusters and scores the result. The silhouette 
+    coefficient is computed on a random sample of silhouette_sample_size rows, as it is quadratic in the number of rows.
+
+    snapshot: The clustering dataset, or the path of the file it was published to.
+    selected_features: The features to cluster on.
+    n_clusters: The number of clusters.
+    random_state: The seed of the centroid initialization and of the silhouette sample.
+    algorithm: "kmeans" for K-Means on every row, or "minibatch" for the mini-batch engine.
+    sample_size: The number of rows the mini-batch engine fits on.
+    max_iter: The maximum number of mini-batches.
+    time_budget: The time the mini-batch engine may take, in seconds.
+    silhouette_sample_size: The number of rows the silhouette coefficient is computed on.
+    """
+    if isinstance(snapshot, str):
+        scaled_data = worker_scaled_features(snapshot, tuple(selected_features))
+    else:
+        scaled_data = StandardScaler().fit_transform(snapshot.select(selected_features))
+
+    labels, _ = cluster_scaled(scaled_data, n_clusters, random_state, algorithm, sample_size, max_iter, time_budget)
+
+    # The scores are undefined unless the rows fall into at least two clusters
+    if len(np.unique(labels)) < 2:
+        silhouette, calinski_harabasz, davies_bouldin = None, None, None
+    else:
+        silhouette, calinski_harabasz, davies_bouldin = evaluate_clustering_performance(
+            scaled_data, labels, sample_size = silhouette_sample_size, random_state = random_state
+        )
+
+    return {
+        "n_clusters": n_clusters,
+        "silhouette": silhouette,
+        "calinski_harabasz": calinski_harabasz,
+        "davies_bouldin": davies_bouldin,
+        "cluster_sizes": np.bincount(labels, minlength = n_clusters).tolist(),
+    }
+
+def cluster_map(snapshot: Union[str, ClusteringSnapshot], labels: np.ndarray) -> str:
+    """
+    Creates the choropleth map of the clusters, with the excluded areas in grey. Returns the figure JSON.
+
+    snapshot: The clustering dataset, or the path of the file it was published to.
+    labels: The cluster label of each row of the snapshot.
+    """
+    snapshot = resolve_snapshot(snapshot)
+    cluster_column = CLUSTERING_DATASETS[snapshot.dataset]["cluster_column"]
+
+    gdf = snapshot.gdf[["Community Name", "geometry"]].copy()
+    gdf[cluster_column] = labels
+
+    fig = px.choropleth_mapbox(
+        gdf,
+        geojson = gdf.geometry,
+        locations = gdf.index,
+        color = cluster_column,
+        color_continuous_scale = px.colors.qualitative.Vivid,
+        hover_name = "Community Name",
+        title = CLUSTERING_DATASETS[snapshot.dataset]["title"],
+        center = MAP_CENTER,
+        zoom = MAP_ZOOM,
+        opacity = 0.5,
+        mapbox_style = "carto-positron"
+    )
+
+    excluded_layer = go.Choroplethmapbox(
+        geojson = snapshot.excluded_geojson,
+        locations = list(range(len(snapshot.excluded_geojson["features"]))),
+        z = [1] * len(snapshot.excluded_geojson["features"]),
+        colorscale = ["#AAAAAA", "#AAAAAA"],
+        showscale = False,
+        hoverinfo = "text",
+    )
+
+    fig.add_trace(excluded_layer)
+
+    return fig.to_json()
+
+def cluster_info(snapshot: Union[str, ClusteringSnapshot], selected_features: List[str], labels: np.ndarray) -> str:
+    """
+    Returns the mean of each selected feature per cluster, as JSON records.
+
+    snapshot: The clustering dataset, or the path of the file it was published to.
+    selected_features: The features the clusters were fitted on.
+    labels: The cluster label of each row of the snapshot.
+    """
+    snapshot = resolve_snapshot(snapshot)
+    cluster_column = CLUSTERING_DATASETS[snapshot.dataset]["cluster_column"]
+
+    df = pd.DataFrame(snapshot.select(selected_features), columns = selected_features)
+    df[cluster_column] = labels
+
+    result = df.groupby(cluster_column).mean().reset_index()
+    return result.to_json(orient = "records")
+
+def cluster_info_full(snapshot: Union[str, ClusteringSnapshot], selected_features: List[str], labels: np.ndarray) -> str:
+    """
+    Returns the mean, median and standard deviation of each selected feature per community and cluster, as JSON records.
+
+    snapshot: The clustering dataset, or the path of the file it was published to.
+    selected_features: The features the clusters were fitted on.
+    labels: The cluster label of each row of the snapshot.
+    """
+    snapshot = resolve_snapshot(snapshot)
+    cluster_column = CLUSTERING_DATASETS[snapshot.dataset]["cluster_column"]
+
+    df = pd.DataFrame(snapshot.select(selected_features), columns = selected_features)
+    df.insert(0, "Community Name", snapshot.gdf["Community Name"].to_numpy())
+    df[cluster_column] = labels
+
+    result = df.groupby(["Community Name", cluster_column])[selected_features].agg(["mean", "median", "std"])
+    return result.to_json(orient = "records")
@@ -1,4 +1,138 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+from fastapi import Header, Query, Request
+from pydantic import BaseModel, Field, model_validator
+
+# Define the media types the table routes can respond with
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+GEOJSON_MEDIA_TYPE = "application/geo+json"
+
+# Define the page size limits for the table routes
+DEFAULT_PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 10000
+
+# Define the query parameters of the table routes that are not column filters
+TABLE_QUERY_PARAMETERS = {"fields", "limit", "cursor", "bbox", "zoom", "geometry_format", "precision"}
+AGGREGATE_QUERY_PARAMETERS = {"group_by", "aggregates"}
+
+# Define the defaults and limits of the mini-batch clustering engine. It fits on a random sample of the rows, 
+# for at most max_iter mini-batches or time_budget seconds, and then assigns every row to its nearest centroid.
+DEFAULT_CLUSTERING_SAMPLE_SIZE = 10000
+MAX_CLUSTERING_SAMPLE_SIZE = 100000
+DEFAULT_CLUSTERING_MAX_ITER = 100
+MAX_CLUSTERING_MAX_ITER = 1000
+DEFAULT_CLUSTERING_TIME_BUDGET = 2.0
+MAX_CLUSTERING_TIME_BUDGET = 10.0
+
+# Define the clustering parameters only the mini-batch engine uses. Exact k-means fits ignore them.
+MINIBATCH_PARAMETERS = {"sample_size", "max_iter", "time_budget"}
+
+# Define the artifacts the unified clustering routes can return: the cluster map, the mean of each feature 
+# per cluster, and the mean, median and standard deviation of each feature per community and cluster
+ClusteringArtifact = Literal["map", "info", "info_full"]
+CLUSTERING_ARTIFACTS = ["map", "info", "info_full"]
+
+# Define the defaults and limits of the k-sweep routes
+DEFAULT_SWEEP_MIN_CLUSTERS = 2
+DEFAULT_SWEEP_MAX_CLUSTERS = 10
+MAX_SWEEP_CLUSTERS = 20
+DEFAULT_SILHOUETTE_SAMPLE_SIZE = 2000
+MAX_SILHOUETTE_SAMPLE_SIZE = 20000
+
+class TableQueryParams:
+    """
+    Query parameters shared by the table routes.
+
+    fields: Comma-separated list of columns to return. All columns are returned if omitted.
+    limit: Maximum number of rows to return. The whole table is returned if neither limit nor cursor is given.
+    cursor: Opaque keyset token returned in the X-Next-Cursor header of the previous page.
+    bbox: Bounding box "minx,miny,maxx,maxy" in EPSG:4326. Only rows whose geometry intersects it are returned.
+    zoom: Map zoom level. Polygon layers are returned with geometry simplified for that zoom level.
+    geometry_format: Encoding of geometry columns in JSON output, hex WKB (the default) or GeoJSON objects.
+    precision: Number of decimal places of GeoJSON coordinates.
+    accept: The Accept header. Selects newline-delimited JSON, GeoJSON FeatureCollection, Arrow IPC stream or Parquet output instead of JSON.
+    if_none_match: The If-None-Match header, used to answer with 304 Not Modified.
+    accept_encoding: The Accept-Encoding header, used to pick a compressed variant of the response.
+
+    Any other query parameter is a filter on the column of the same name, e.g. ?Community Name=BRENTWOOD. 
+    Repeating a parameter matches any of the given values.
+    """
+    def __init__(
+        self,
+        request: Request,
+        fields: Optional[str] = Query(None),
+        limit: Optional[int] = Query(None, ge = 1, le = MAX_PAGE_LIMIT),
+        cursor: Optional[str] = Query(None),
+        bbox: Optional[str] = Query(None),
+        zoom: Optional[float] = Query(None, ge = 0, le = 22),
+        geometry_format: Literal["wkb", "geojson"] = Query("wkb"),
+        precision: int = Query(6, ge = 0, le = 15),
+        accept: Optional[str] = Header(None),
+        if_none_match: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None),
+    ):
+        self.fields = fields
+        self.limit = limit
+        self.cursor = cursor
+        self.bbox = bbox
+        self.zoom = zoom
+        self.geometry_format = geometry_format
+        self.precision = precision
+        self.accept = accept or ""
+        self.if_none_match = if_none_match
+        self.accept_encoding = accept_encoding
+        self.filters = tuple(sorted(
+            (key, value) for key, value in request.query_params.multi_items() if key not in TABLE_QUERY_PARAMETERS
+        ))
+
+    @property
+    def paginated(self) -> bool:
+        return self.limit is not None or self.cursor is not None
+
+    @property
+    def output_format(self) -> str:
+        if NDJSON_MEDIA_TYPE in self.accept:
+            return "ndjson"
+        if GEOJSON_MEDIA_TYPE in self.accept:
+            return "geojson"
+        if ARROW_STREAM_MEDIA_TYPE in self.accept:
+            return "arrow"
+        if PARQUET_MEDIA_TYPE in self.accept or "application/x-parquet" in self.accept:
+            return "parquet"
+        return "json"
+
+    @property
+    def stream(self) -> bool:
+        return self.output_format == "ndjson"
+
+class AggregateQueryParams:
+    """
+    Query parameters of the aggregate route.
+
+    group_by: Comma-separated list of columns to group by. The whole table is one group if omitted.
+    aggregates: Comma-separated list of aggregates, e.g. count,median(ASSESSED_VALUE). The supported functions are 
+        count, sum, mean and median. count without a column counts rows, the others take a numeric column.
+    if_none_match: The If-None-Match header, used to answer with 304 Not Modified.
+    accept_encoding: The Accept-Encoding header, used to pick a compressed variant of the response.
+
+    Any other query parameter is a filter on the column of the same name, as on the table routes.
+    """
+    def __init__(
+        self,
+        request: Request,
+        group_by: Optional[str] = Query(None),
+        aggregates: str = Query("count"),
+        if_none_match: Optional[str] = Header(None),
+        accept_encoding: Optional[str] = Header(None),
+    ):
+        self.group_by = group_by
+        self.aggregates = aggregates
+        self.if_none_match = if_none_match
+        self.accept_encoding = accept_encoding
+        self.filters = tuple(sorted(
+            (key, value) for key, value in request.query_params.multi_items() if key not in AGGREGATE_QUERY_PARAMETERS
+        ))
 
 class KMeansPostalModelInput(BaseModel):
     median_assessed_value: bool = True
@@ -22,6 +156,11 @@ class KMeansPostalModelInput(BaseModel):
     n_clusters: int = 3
     random_state: int = 42
 
+    algorithm: Literal["kmeans", "minibatch"] = "kmeans"
+    sample_size: int = Field(DEFAULT_CLUSTERING_SAMPLE_SIZE, ge = 1, le = MAX_CLUSTERING_SAMPLE_SIZE)
+    max_iter: int = Field(DEFAULT_CLUSTERING_MAX_ITER, ge = 1, le = MAX_CLUSTERING_MAX_ITER)
+    time_budget: float = Field(DEFAULT_CLUSTERING_TIME_BUDGET, gt = 0, le = MAX_CLUSTERING_TIME_BUDGET)
+
 class KMeansCommunityModelInput(BaseModel):
     count_of_population_in_private_households: bool = True
     median_household_income: bool = True
@@ -44,3 +183,33 @@ class KMeansCommunityModelInput(BaseModel):
 
     n_clusters: int = 3
     random_state: int = 42
+
+    algorithm: Literal["kmeans", "minibatch"] = "kmeans"
+    sample_size: int = Field(DEFAULT_CLUSTERING_SAMPLE_SIZE, ge = 1, le = MAX_CLUSTERING_SAMPLE_SIZE)
+    max_iter: int = Field(DEFAULT_CLUSTERING_MAX_ITER, ge = 1, le = MAX_CLUSTERING_MAX_ITER)
+    time_budget: float = Field(DEFAULT_CLUSTERING_TIME_BUDGET, gt = 0, le = MAX_CLUSTERING_TIME_BUDGET)
+
+class KMeansPostalArtifactsInput(KMeansPostalModelInput):
+    artifacts: List[ClusteringArtifact] = Field(default_factory = lambda: list(CLUSTERING_ARTIFACTS), min_length = 1)
+
+class KMeansCommunityArtifactsInput(KMeansCommunityModelInput):
+    artifacts: List[ClusteringArtifact] = Field(default_factory = lambda: list(CLUSTERING_ARTIFACTS), min_length = 1)
+
+class KMeansSweepParams(BaseModel):
+    min_clusters: int = Field(DEFAULT_SWEEP_MIN_CLUSTERS, ge = 2, le = MAX_SWEEP_CLUSTERS)
+    max_clusters: int = Field(DEFAULT_SWEEP_MAX_CLUSTERS, ge = 2, le = MAX_SWEEP_CLUSTERS)
+    silhouette_sample_size: int = Field(DEFAULT_SILHOUETTE_SAMPLE_SIZE, ge = 100, le = MAX_SILHOUETTE_SAMPLE_SIZE)
+
+    @model_validator(mode = "after")
+    def check_cluster_range(self):
+        if self.min_clusters > self.max_clusters:
+            raise ValueError("min_clusters must not be greater than max_clusters")
+        return self
+
+# The sweep covers min_clusters to max_clusters, so n_clusters is accepted for compatibility with the 
+# model inputs but ignored, and left out of the dump that keys concurrent sweeps
+class KMeansPostalSweepInput(KMeansPostalModelInput, KMeansSweepParams):
+    n_clusters: Optional[int] = Field(None, exclude = True)
+
+class KMeansCommunitySweepInput(KMeansCommunityModelInput, KMeansSweepParams):
+    n_clusters: Optional[int] = Field(None, exclude = True)
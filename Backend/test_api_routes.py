@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 import pytest
@@ -284,3 +285,294 @@ def test_get_vacant_apartments():
     assert response.status_code == 200
     assert len(data) > 0
     assert all(expected_columns.issubset(data[0].keys()) for item in data)
+
+def test_get_building_permits_paginated():
+    dataset = "building_permits"
+    params = {"fields": "PermitNum,CommunityName", "limit": 100}
+    response = requests.get(base_url + dataset, headers = headers, params = params)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) == 100
+    assert all(set(item.keys()) == {"PermitNum", "CommunityName"} for item in data)
+    assert "X-Next-Cursor" in response.headers
+
+    params["cursor"] = response.headers["X-Next-Cursor"]
+    next_response = requests.get(base_url + dataset, headers = headers, params = params)
+    next_data = next_response.json()
+
+    assert next_response.status_code == 200
+    assert len(next_data) > 0
+    assert next_data[0] not in data
+
+def test_get_building_permits_pages_cover_the_table():
+    dataset = "building_permits"
+    full_data = requests.get(base_url + dataset, headers = headers).json()
+
+    paged_data = []
+    params = {"limit": 1000}
+
+    while True:
+        response = requests.get(base_url + dataset, headers = headers, params = params)
+
+        assert response.status_code == 200
+
+        paged_data.extend(response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+
+    assert sorted(json.dumps(item, sort_keys = True) for item in paged_data) == sorted(
+        json.dumps(item, sort_keys = True) for item in full_data
+    )
+    assert all("__row_id" not in item for item in paged_data)
+
+def test_get_building_permits_unknown_field():
+    dataset = "building_permits"
+    response = requests.get(base_url + dataset, headers = headers, params = {"fields": "NotAColumn"})
+
+    assert response.status_code == 400
+
+def test_get_land_use_districts_bbox():
+    dataset = "land_use_districts"
+    params = {"bbox": "-114.0,51.05,-113.95,51.1"}
+    response = requests.get(base_url + dataset, headers = headers, params = params)
+    data = response.json()
+
+    full_response = requests.get(base_url + dataset, headers = headers)
+    full_data = full_response.json()
+
+    assert response.status_code == 200
+    assert 0 < len(data) < len(full_data)
+
+def test_get_community_crime_statistics_filtered():
+    dataset = "community_crime_statistics"
+    community_name = requests.get(base_url + dataset, headers = headers).json()[0]["Community Name"]
+    response = requests.get(base_url + dataset, headers = headers, params = {"Community Name": community_name})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) > 0
+    assert all(item["Community Name"] == community_name for item in data)
+
+def test_get_building_permits_unknown_filter():
+    dataset = "building_permits"
+    response = requests.get(base_url + dataset, headers = headers, params = {"NotAColumn": "1"})
+
+    assert response.status_code == 400
+
+def test_get_aggregate_building_permits():
+    params = {"group_by": "CommunityName", "aggregates": "count"}
+    response = requests.get(base_url + "aggregate/building_permits", headers = headers, params = params)
+    data = response.json()
+
+    full_response = requests.get(base_url + "building_permits", headers = headers)
+    full_data = full_response.json()
+
+    assert response.status_code == 200
+    assert len(data) > 0
+    assert all(set(item.keys()) == {"CommunityName", "count"} for item in data)
+    assert sum(item["count"] for item in data) == len(full_data)
+
+def test_get_aggregate_median_requires_numeric_column():
+    params = {"aggregates": "median(CommunityName)"}
+    response = requests.get(base_url + "aggregate/building_permits", headers = headers, params = params)
+
+    assert response.status_code == 400
+
+def test_get_clustering_metrics():
+    response = requests.get(base_url + "metrics/clustering", headers = headers)
+    data = response.json()
+
+    expected_keys = {"max_concurrency", "max_queue", "running", "queue_depth", "admitted", "rejected", 
+                     "mean_wait_seconds", "max_wait_seconds", "mean_run_seconds"}
+
+    assert response.status_code == 200
+    assert expected_keys.issubset(data.keys())
+
+def test_get_kmeans_postal_info_minibatch():
+    body = {"n_clusters": 4, "algorithm": "minibatch", "sample_size": 1000, "max_iter": 20}
+    response = requests.post(base_url + "kmeans_postal_info", headers = headers, json = body)
+    data = json.loads(response.json())
+
+    assert response.status_code == 200
+    assert len(data) <= 4
+    assert all("KMeans Postal Cluster" in item for item in data)
+
+def test_get_kmeans_postal_artifacts():
+    body = {"n_clusters": 4, "artifacts": ["map", "info"]}
+    response = requests.post(base_url + "kmeans_postal_artifacts", headers = headers, json = body)
+    data = response.json()
+
+    info_response = requests.post(base_url + "kmeans_postal_info", headers = headers, json = {"n_clusters": 4})
+
+    assert response.status_code == 200
+    assert set(data.keys()) == {"map", "info"}
+    assert "data" in data["map"]
+    assert data["info"] == json.loads(info_response.json())
+
+def test_get_kmeans_postal_sweep():
+    body = {"min_clusters": 2, "max_clusters": 5, "silhouette_sample_size": 500}
+    response = requests.post(base_url + "kmeans_postal_sweep", headers = headers, json = body)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert [item["n_clusters"] for item in data] == [2, 3, 4, 5]
+    assert all(-1 <= item["silhouette"] <= 1 for item in data)
+    assert all(item["calinski_harabasz"] > 0 and item["davies_bouldin"] >= 0 for item in data)
+
+def test_get_kmeans_postal_sweep_invalid_range():
+    body = {"min_clusters": 6, "max_clusters": 3}
+    response = requests.post(base_url + "kmeans_postal_sweep", headers = headers, json = body)
+
+    assert response.status_code == 422
+
+def test_get_congestion_map_asset_references():
+    response = requests.get(base_url + "maps/congestion", headers = headers, params = {"assets": "reference"})
+    data = response.json()
+
+    references = [
+        trace["geojson"] for trace in data["data"] 
+        if isinstance(trace.get("geojson"), dict) and "$asset" in trace["geojson"]
+    ]
+
+    assert response.status_code == 200
+    assert len(references) > 0
+
+    for reference in references:
+        asset_response = requests.get(
+            base_url + f"map_assets/{reference['$asset']}/{reference['version']}", headers = headers
+        )
+
+        assert asset_response.status_code == 200
+        assert asset_response.json()["type"] == "FeatureCollection"
+
+def test_get_congestion_map_embedded_assets():
+    response = requests.get(base_url + "maps/congestion", headers = headers)
+    data = response.json()
+
+    geojson_traces = [trace["geojson"] for trace in data["data"] if "geojson" in trace]
+
+    assert response.status_code == 200
+    assert len(geojson_traces) > 0
+    assert all("$asset" not in geojson for geojson in geojson_traces)
+    assert all(geojson["type"] == "FeatureCollection" for geojson in geojson_traces)
+
+def test_get_building_permits_invalid_cursor():
+    response = requests.get(base_url + "building_permits", headers = headers, params = {"limit": 10, "cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+def test_get_schools_not_modified():
+    response = requests.get(base_url + "schools", headers = headers)
+    etag = response.headers["ETag"]
+
+    revalidated_response = requests.get(base_url + "schools", headers = {**headers, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert revalidated_response.status_code == 304
+    assert revalidated_response.headers["ETag"] == etag
+
+def test_get_building_permits_gzip():
+    response = requests.get(base_url + "building_permits", headers = {**headers, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"].endswith('-gzip"')
+    assert len(response.json()) > 0
+
+def test_get_building_permits_ndjson():
+    response = requests.get(base_url + "building_permits", headers = {**headers, "Accept": "application/x-ndjson"})
+    lines = response.text.splitlines()
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/x-ndjson")
+    assert len(lines) > 0
+    assert all(isinstance(json.loads(line), dict) for line in lines)
+
+def test_get_building_permits_arrow():
+    response = requests.get(
+        base_url + "building_permits", 
+        headers = {**headers, "Accept": "application/vnd.apache.arrow.stream"}, 
+        params = {"limit": 10}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/vnd.apache.arrow.stream")
+    assert "Accept" in [value.strip() for value in response.headers["Vary"].split(",")]
+    # Arrow IPC streams begin with the continuation marker of the schema message
+    assert response.content[:4] == b"\xff\xff\xff\xff"
+
+def test_get_land_use_districts_tile():
+    response = requests.get(base_url + "tiles/land_use_districts/10/187/342.mvt", headers = headers)
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/vnd.mapbox-vector-tile")
+
+def test_get_tile_unknown_layer():
+    response = requests.get(base_url + "tiles/not_a_layer/10/187/342.mvt", headers = headers)
+
+    assert response.status_code == 404
+
+def test_get_map_asset_not_found():
+    response = requests.get(base_url + "map_assets/community_boundaries/not-a-version", headers = headers)
+
+    assert response.status_code == 404
+
+def flatten_coordinates(coordinates):
+    if isinstance(coordinates, (int, float)):
+        return [coordinates]
+    return [value for item in coordinates for value in flatten_coordinates(item)]
+
+def test_get_community_district_boundaries_geojson_geometry():
+    dataset = "community_district_boundaries"
+    params = {"geometry_format": "geojson", "precision": 2}
+    response = requests.get(base_url + dataset, headers = headers, params = params)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) > 0
+    assert all(isinstance(item["geometry"], dict) for item in data)
+    assert all(item["geometry"]["type"] in {"Polygon", "MultiPolygon"} for item in data)
+
+    coordinates = [value for item in data for value in flatten_coordinates(item["geometry"]["coordinates"])]
+
+    assert len(coordinates) > 0
+    assert all(round(value, 2) == value for value in coordinates)
+
+def test_get_community_district_boundaries_feature_collection():
+    dataset = "community_district_boundaries"
+    response = requests.get(base_url + dataset, headers = {**headers, "Accept": "application/geo+json"})
+    data = response.json()
+
+    full_data = requests.get(base_url + dataset, headers = headers).json()
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("application/geo+json")
+    assert data["type"] == "FeatureCollection"
+    assert len(data["features"]) == len(full_data)
+    assert all(feature["type"] == "Feature" for feature in data["features"])
+    assert all(isinstance(feature["geometry"], dict) for feature in data["features"])
+    assert all("geometry" not in feature["properties"] for feature in data["features"])
+
+def test_get_community_district_boundaries_zoom():
+    dataset = "community_district_boundaries"
+    full_data = requests.get(base_url + dataset, headers = headers).json()
+
+    response = requests.get(base_url + dataset, headers = headers, params = {"zoom": 8})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert len(data) == len(full_data)
+    assert sorted(item["Community Name"] for item in data) == sorted(item["Community Name"] for item in full_data)
+    assert all(item.keys() == full_item.keys() for item, full_item in zip(data, full_data))
+    assert sum(len(item["geometry"]) for item in data) < sum(len(item["geometry"]) for item in full_data)
+
+def test_get_community_district_boundaries_zoom_beyond_simplification():
+    dataset = "community_district_boundaries"
+    full_data = requests.get(base_url + dataset, headers = headers).json()
+
+    response = requests.get(base_url + dataset, headers = headers, params = {"zoom": 13})
+
+    assert response.status_code == 200
+    assert response.json() == full_data
@@ -1,7 +1,19 @@
+import base64
 import binascii
+import io
+import json
+import math
+import re
+from collections.abc import Mapping
+from datetime import date, datetime
+from decimal import Decimal
+import orjson
+from fastapi import Response
+import pyarrow as pa
+import pyarrow.parquet as pq
 from sklearn.metrics import silhouette_score, calinski_harabasz_score, davies_bouldin_score
 from shapely import wkb, wkt
-from typing import List, Union
+from typing import Dict, List, Optional, Tuple, Union
 from models import KMeansPostalModelInput, KMeansCommunityModelInput
 
 def wkb_to_wkt(wkb_hex):
@@ -13,16 +25,331 @@ def wkb_to_wkt(wkb_hex):
     """
     return wkb.loads(binascii.unhexlify(wkb_hex))
 
-def evaluate_clustering_performance(X, cluster_labels):
+def _default_json(value):
+    """
+    Serializes the values orjson does not support natively. RowMappings become objects, Decimals 
+    (Postgres numeric columns) become numbers and binary geometries become upper-case hex WKB, the 
+    same format Postgres uses for geometry columns.
+    """
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex().upper()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps_rows(content) -> bytes:
+    """
+    Serializes query results straight to JSON bytes with orjson, without going through jsonable_encoder. 
+    Datetimes, dates, UUIDs and NumPy values are handled natively by orjson.
+
+    content: The rows (or any other JSON-compatible value) to serialize.
+    """
+    return orjson.dumps(content, default = _default_json, option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+class RowJSONResponse(Response):
+    """
+    JSON response for lists of SQLAlchemy RowMappings, serialized with dumps_rows.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps_rows(content)
+
+def find_map_assets(figure: dict) -> List[Tuple[str, str]]:
+    """
+    Returns the (name, version) of every map asset referenced by the traces of a prerendered figure.
+
+    figure: The parsed figure JSON.
+    """
+    return [
+        (trace["geojson"]["$asset"], trace["geojson"]["version"]) 
+        for trace in figure.get("data", []) 
+        if isinstance(trace.get("geojson"), dict) and "$asset" in trace["geojson"]
+    ]
+
+def embed_map_assets(figure: dict, assets: Dict[Tuple[str, str], bytes]) -> bytes:
+    """
+    Replaces the map asset references of a prerendered figure with the GeoJSON of the assets and serializes 
+    the figure. The assets are embedded as already serialized JSON, so their geometry is not parsed or 
+    encoded again.
+
+    figure: The parsed figure JSON.
+    assets: The GeoJSON text of each referenced asset, keyed by (name, version).
+    """
+    for trace in figure.get("data", []):
+        if isinstance(trace.get("geojson"), dict) and "$asset" in trace["geojson"]:
+            trace["geojson"] = orjson.Fragment(assets[(trace["geojson"]["$asset"], trace["geojson"]["version"])])
+    return orjson.dumps(figure)
+
+def rows_to_arrow(rows: List[Mapping], geometry_columns: List[str]) -> pa.Table:
+    """
+    Converts query results into an Arrow table. Geometry columns must already be binary WKB (ST_AsBinary); 
+    they are tagged as geoarrow.wkb and described in GeoParquet metadata, so geopandas.read_parquet and 
+    GeoArrow-aware readers decode them without further work.
+
+    rows: The rows to convert.
+    geometry_columns: The names of the binary WKB geometry columns.
+    """
+    table = pa.Table.from_pylist([dict(row) for row in rows])
+
+    fields = [
+        field.with_metadata({"ARROW:extension:name": "geoarrow.wkb"}) if field.name in geometry_columns else field
+        for field in table.schema
+    ]
+    geometry_columns = [column for column in geometry_columns if column in table.column_names]
+
+    metadata = {}
+    if geometry_columns:
+        metadata[b"geo"] = json.dumps({
+            "version": "1.0.0",
+            "primary_column": geometry_columns[0],
+            "columns": {column: {"encoding": "WKB", "geometry_types": []} for column in geometry_columns},
+        })
+
+    return table.cast(pa.schema(fields, metadata = metadata))
+
+def arrow_ipc_bytes(table: pa.Table) -> bytes:
+    """
+    Serializes an Arrow table in the Arrow IPC streaming format.
+
+    table: The Arrow table to serialize.
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def parquet_bytes(table: pa.Table) -> bytes:
+    """
+    Serializes an Arrow table as a zstd-compressed Parquet file.
+
+    table: The Arrow table to serialize.
+    """
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression = "zstd")
+    return sink.getvalue()
+
+def quote_identifier(name: str) -> str:
+    """
+    Quotes a table or column name for use in SQL. Most column names in the database contain spaces or upper case letters (e.g. "Community Name").
+
+    name: The table or column name.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+def parse_fields(fields: Optional[str], columns: Dict[str, str]) -> List[str]:
+    """
+    Parses the comma-separated fields query parameter and validates it against the columns of a table.
+    Returns all columns if no fields are given. Raises a ValueError if a field is not a column of the table.
+
+    fields: The comma-separated list of columns requested by the client.
+    columns: The columns of the table, mapped to their database type.
+    """
+    if not fields:
+        return list(columns)
+
+    selected_fields = []
+
+    for field in fields.split(","):
+        field = field.strip()
+        if not field or field in selected_fields:
+            continue
+        if field not in columns:
+            raise ValueError(f"Unknown field: {field}")
+        selected_fields.append(field)
+
+    return selected_fields
+
+# Define the SQL of the aggregate functions
+AGGREGATE_FUNCTIONS = {
+    "count": "count({column})",
+    "sum": "sum({column})",
+    "mean": "avg({column})",
+    "median": "percentile_cont(0.5) WITHIN GROUP (ORDER BY {column})",
+}
+NUMERIC_TYPES = {"int2", "int4", "int8", "float4", "float8", "numeric"}
+
+def parse_aggregates(aggregates: str, columns: Dict[str, str]) -> List[Tuple[str, str]]:
+    """
+    Parses the comma-separated aggregates query parameter, e.g. count,median(ASSESSED_VALUE), and validates it 
+    against the columns of a table. Returns the name of each aggregate, as given by the client, together with its SQL. 
+    Raises a ValueError if an aggregate is malformed or its column does not exist or is not numeric.
+
+    aggregates: The comma-separated list of aggregates requested by the client.
+    columns: The columns of the table, mapped to their database type.
+    """
+    parsed_aggregates = []
+
+    for aggregate in aggregates.split(","):
+        aggregate = aggregate.strip()
+        if not aggregate or aggregate in (name for name, _ in parsed_aggregates):
+            continue
+
+        match = re.fullmatch(r"(\w+)(?:\((.+)\))?", aggregate)
+        if match is None or match.group(1) not in AGGREGATE_FUNCTIONS:
+            raise ValueError(f"Unknown aggregate: {aggregate}")
+
+        function, column = match.groups()
+
+        if column is None:
+            if function != "count":
+                raise ValueError(f"Aggregate {function} requires a column")
+            parsed_aggregates.append((aggregate, "count(*)"))
+            continue
+
+        if column not in columns:
+            raise ValueError(f"Unknown field: {column}")
+        if function != "count" and columns[column] not in NUMERIC_TYPES:
+            raise ValueError(f"Aggregate {function} requires a numeric column: {column}")
+
+        parsed_aggregates.append((aggregate, AGGREGATE_FUNCTIONS[function].format(column = quote_identifier(column))))
+
+    if not parsed_aggregates:
+        raise ValueError("At least one aggregate is required")
+
+    return parsed_aggregates
+
+def parse_filters(filters: Tuple[Tuple[str, str], ...], columns: Dict[str, str]) -> Dict[str, list]:
+    """
+    Validates column filters against the columns of a table and converts the values to the type of their column.
+    Returns the values of each filtered column. Raises a ValueError if a column does not exist, cannot be 
+    filtered on, or a value does not match the type of its column.
+
+    filters: The (column, value) pairs sent by the client.
+    columns: The columns of the table, mapped to their database type.
+    """
+    parsed_filters = {}
+
+    for column, value in filters:
+        if column not in columns:
+            raise ValueError(f"Unknown filter: {column}")
+
+        column_type = columns[column]
+        if column_type == "geometry":
+            raise ValueError(f"Cannot filter on geometry column: {column}")
+
+        try:
+            if column_type in ("int2", "int4", "int8"):
+                value = int(value)
+            elif column_type in ("float4", "float8"):
+                value = float(value)
+            elif column_type == "numeric":
+                value = Decimal(value)
+            elif column_type == "bool":
+                value = {"true": True, "false": False}[value.lower()]
+            elif column_type == "date":
+                value = date.fromisoformat(value)
+            elif column_type in ("timestamp", "timestamptz"):
+                value = datetime.fromisoformat(value)
+        except (ArithmeticError, KeyError, ValueError):
+            raise ValueError(f"Invalid value for {column}: {value}")
+
+        parsed_filters.setdefault(column, []).append(value)
+
+    return parsed_filters
+
+def compile_filters(filters: Dict[str, list]) -> Tuple[List[str], Dict[str, object]]:
+    """
+    Compiles parsed column filters into SQL conditions and their bound parameters. A column with several 
+    values matches any of them.
+
+    filters: The values of each filtered column, as returned by parse_filters.
+    """
+    conditions = []
+    query_params = {}
+
+    for index, (column, values) in enumerate(filters.items()):
+        if len(values) == 1:
+            conditions.append(f"{quote_identifier(column)} = :filter_{index}")
+            query_params[f"filter_{index}"] = values[0]
+        else:
+            conditions.append(f"{quote_identifier(column)} = ANY(:filter_{index})")
+            query_params[f"filter_{index}"] = values
+
+    return conditions, query_params
+
+def parse_bbox(bbox: str) -> Tuple[float, float, float, float]:
+    """
+    Parses a "minx,miny,maxx,maxy" bounding box. Raises a ValueError if it is malformed.
+
+    bbox: The bounding box sent by the client, in EPSG:4326 coordinates.
+    """
+    try:
+        minx, miny, maxx, maxy = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("bbox must be minx,miny,maxx,maxy")
+
+    if not all(math.isfinite(value) for value in (minx, miny, maxx, maxy)) or minx > maxx or miny > maxy:
+        raise ValueError("bbox must be minx,miny,maxx,maxy")
+
+    return (minx, miny, maxx, maxy)
+
+class StaleCursorError(ValueError):
+    """
+    Raised for a cursor issued for an earlier version of the table. The rows it points after no longer exist.
+    """
+
+def encode_cursor(table_name: str, version: Optional[str], key: str, position: Union[int, str]) -> str:
+    """
+    Encodes the position of the last row of a page into an opaque cursor for keyset pagination.
+
+    table_name: The table being paginated.
+    version: The dataset version of the table. Row ids only mean something within one version.
+    key: The column the pages are keyed on, the row id column or ctid.
+    position: The key of the last row of the page.
+    """
+    payload = json.dumps({"table": table_name, "version": version, "key": key, "after": position}, separators = (",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, table_name: str, version: Optional[str], key: str) -> Union[int, str]:
+    """
+    Decodes a cursor created by encode_cursor and returns the key of the row it points after.
+    Raises a ValueError if the cursor is malformed or was issued for a different table, and a 
+    StaleCursorError if it was issued for a different version of the table.
+
+    cursor: The cursor sent by the client.
+    table_name: The table being paginated.
+    version: The current dataset version of the table.
+    key: The column the pages of the table are keyed on, the row id column or ctid.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(payload, dict) or payload.get("table") != table_name:
+        raise ValueError("Invalid cursor")
+    if payload.get("version") != version:
+        raise StaleCursorError("The table has been updated since the cursor was issued, start again from the first page")
+
+    position = payload.get("after")
+    if key == "ctid":
+        valid = isinstance(position, str) and re.fullmatch(r"\(\d+,\d+\)", position) is not None
+    else:
+        valid = isinstance(position, int) and not isinstance(position, bool)
+    if payload.get("key") != key or not valid:
+        raise ValueError("Invalid cursor")
+
+    return position
+
+def evaluate_clustering_performance(X, cluster_labels, sample_size: Optional[int] = None, random_state: Optional[int] = None):
     """
     Evaluate clustering performance using various metrics.
 
     X: The original data used for clustering - should be scaled.
     cluster_labels: The cluster labels assigned to each data point.
+    sample_size: The number of data points the silhouette coefficient is computed on. It is quadratic in the 
+    number of data points, so large datasets are sampled. All data points are used if omitted.
+    random_state: The seed of the silhouette sample.
     """
 
     # Silhouette coefficient: Higher is better (-1 to 1)
-    silhouette_avg = silhouette_score(X, cluster_labels)
+    if sample_size is not None and sample_size < len(X):
+        silhouette_avg = silhouette_score(X, cluster_labels, sample_size = sample_size, random_state = random_state)
+    else:
+        silhouette_avg = silhouette_score(X, cluster_labels)
 
     # Calinski-Harabasz Index: Higher is better
     calinski_harabasz = calinski_harabasz_score(X, cluster_labels)
@@ -30,11 +357,7 @@ def evaluate_clustering_performance(X, cluster_labels):
     # Davies-Bouldin Index: Lower is better
     davies_bouldin = davies_bouldin_score(X, cluster_labels)
 
-    print(f"Silhouette Coefficient: {silhouette_avg:.3f}")
-    print(f"Calinski-Harabasz Index: {calinski_harabasz:.3f}")
-    print(f"Davies-Bouldin Index: {davies_bouldin:.3f}")
-
-    return (silhouette_avg, calinski_harabasz, davies_bouldin)
+    return (float(silhouette_avg), float(calinski_harabasz), float(davies_bouldin))
 
 postal_features_dict = {
     "Median Assessed Value": "median_assessed_value",
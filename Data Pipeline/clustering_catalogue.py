@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+from datetime import datetime
+import json
+import logging
+import os
+import sys
+from dotenv import load_dotenv
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+from sqlalchemy import create_engine, text, Column, Integer, String
+from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import declarative_base
+import db_utils
+from db_utils import get_dataset_version
+
+# Create a logs directory if it does not exist
+log_directory = "logs"
+os.makedirs(log_directory, exist_ok = True)
+
+# Create a logger
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Create a file handler which logs messages
+now = datetime.now()
+logfile = os.path.join(log_directory, f"P4_logs_{now.strftime('%Y-%m-%d')}.log")
+file_handler = logging.FileHandler(logfile)
+file_handler.setLevel(logging.INFO)
+
+# Create a formatter and set the formatter for the handler
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+file_handler.setFormatter(formatter)
+
+# Add the file handler to the logger and to the logger of the shared database functions
+logger.addHandler(file_handler)
+db_utils.logger.addHandler(file_handler)
+
+# Load the environment variables
+load_dotenv()
+
+RDS_USERNAME = os.environ.get("RDS_USERNAME")
+RDS_PASSWORD = os.environ.get("RDS_PASSWORD")
+RDS_HOST = os.environ.get("RDS_HOST")
+RDS_PORT = os.environ.get("RDS_PORT")
+RDS_DATABASE = os.environ.get("RDS_DATABASE")
+
+# Define the datasets clustered by the API's /kmeans_* routes: the table, the column that identifies
+# a row, and every feature in the order the API selects them. This stage runs after data_joiner.py.
+CLUSTERING_DATASETS = {
+    "postal": {
+        "table": "postal_codes_with_assessed_values",
+        "key": "Postal Code",
+        "features": [
+            "Median Assessed Value",
+            "Median Land Size",
+            "Distance To Closest Elementary",
+            "Distance To Closest Junior High",
+            "Distance To Closest Senior High",
+            "Distance To Closest Community Centre",
+            "Distance To Closest Attraction",
+            "Distance To Closest Visitor Info",
+            "Distance To Closest Court",
+            "Distance To Closest Library",
+            "Distance To Closest Hospital",
+            "Distance To Closest PHS Clinic",
+            "Distance To Closest Social Dev Ctr",
+            "Distance To Nearest Bus Stop",
+            "Distance To Nearest CTrain Station",
+            "School Count Within 1KM",
+            "Services Count Within 1KM",
+        ],
+    },
+    "community": {
+        "table": "combined_boundaries_and_profile_data",
+        "key": "Community Name",
+        "features": [
+            "Count of Population in Private Households",
+            "Median Household Income",
+            "Count of Population considered Low Income",
+            "Count of Private Households",
+            "Count of Owner Households",
+            "Count of Renter Households",
+            "Count of Private Households With Income",
+            "Count of Households with LT 30 Pct of Total Income on Shelter",
+            "Count of Households with GT 30 Pct of Total Income on Shelter",
+            "Median Owner Monthly Shelter Cost",
+            "Median Renter Monthly Shelter Cost",
+            "Count of Households that Require Maintenance or Minor Repairs",
+            "Count of Households that Require Major Repairs",
+            "Count of Suitable Households",
+            "Count of Unsuitable Households",
+            "Community Crime Count 2023",
+            "Community Disorder Count 2023",
+            "Transit Stops Count",
+        ],
+    },
+}
+
+# Define the feature sets precomputed for each dataset. None stands for every feature, which is what
+# the API's default request body selects. The other sets are the common subsets requested by the front end.
+CLUSTERING_CATALOGUE = {
+    "postal": [
+        None,
+        ["Median Assessed Value", "Median Land Size"],
+        [
+            "Distance To Closest Elementary",
+            "Distance To Closest Junior High",
+            "Distance To Closest Senior High",
+            "School Count Within 1KM",
+        ],
+        ["Distance To Nearest Bus Stop", "Distance To Nearest CTrain Station"],
+    ],
+    "community": [
+        None,
+        ["Median Household Income", "Median Owner Monthly Shelter Cost", "Median Renter Monthly Shelter Cost"],
+        ["Community Crime Count 2023", "Community Disorder Count 2023"],
+    ],
+}
+
+# Define the numbers of clusters precomputed for each feature set, and the seed the API uses by default
+CATALOGUE_MIN_CLUSTERS = int(os.environ.get("CATALOGUE_MIN_CLUSTERS", 2))
+CATALOGUE_MAX_CLUSTERS = int(os.environ.get("CATALOGUE_MAX_CLUSTERS", 10))
+CATALOGUE_RANDOM_STATE = int(os.environ.get("CATALOGUE_RANDOM_STATE", 42))
+
+# Define the base class for the database
+Base = declarative_base()
+
+# Define the class for the precomputed clustering results. Each entry is the K-Means fit for one
+# dataset version, feature set, number of clusters and seed. Labels are keyed by the column that
+# identifies a row, so they do not depend on the order the rows are read in.
+class ClusteringCatalogueEntry(Base):
+    __tablename__ = "clustering_catalogue"
+    dataset = Column(String, primary_key = True)
+    features = Column(String, primary_key = True)
+    n_clusters = Column(Integer, primary_key = True)
+    random_state = Column(Integer, primary_key = True)
+    version = Column(String, nullable = False)
+    labels = Column(JSON)
+    centroids = Column(JSON)
+    scaler_mean = Column(JSON)
+    scaler_scale = Column(JSON)
+    summary = Column(JSON)
+
+# Create a connection to the database
+connection_string = (
+    f"postgresql://{RDS_USERNAME}:{RDS_PASSWORD}@" +
+    f"{RDS_HOST}:{RDS_PORT}/{RDS_DATABASE}"
+)
+db_engine = create_engine(connection_string)
+
+# Check if the connection to the database was successful
+try:
+    with db_engine.connect() as connection:
+        result = connection.execute(text("SELECT 1;"))
+
+    logger.info("Connection to the database was successful.")
+except SQLAlchemyError as e:
+    logger.exception("An error occurred connecting to the database.")
+    sys.exit(1)
+
+# Create the tables in the database
+Base.metadata.create_all(db_engine)
+
+def fit_catalogue_entry(df, dataset, features, n_clusters):
+    """
+    This function fits K-Means to a feature set the same way the API does, and returns the
+    catalogue entry for it.
+
+    Args:
+    - df: The rows of the dataset table, sorted by the key column
+    - dataset: The name of the dataset, "postal" or "community"
+    - features: The feature columns, in the order the API selects them
+    - n_clusters: The number of clusters
+    """
+
+    key = CLUSTERING_DATASETS[dataset]["key"]
+
+    scaler = StandardScaler()
+    scaled_data = scaler.fit_transform(df[features].to_numpy(dtype = np.float64))
+    kmeans = KMeans(n_clusters = n_clusters, random_state = CATALOGUE_RANDOM_STATE)
+    kmeans.fit(scaled_data)
+
+    # Summarize each cluster in the original units of the features
+    clusters = df[features].groupby(kmeans.labels_)
+    summary = [
+        {"cluster": int(cluster), "size": int(len(rows)), "means": rows.mean().to_dict()}
+        for cluster, rows in clusters
+    ]
+
+    return {
+        "dataset": dataset,
+        "features": json.dumps(features),
+        "n_clusters": n_clusters,
+        "random_state": CATALOGUE_RANDOM_STATE,
+        "labels": dict(zip(df[key], kmeans.labels_.tolist())),
+        "centroids": kmeans.cluster_centers_.tolist(),
+        "scaler_mean": scaler.mean_.tolist(),
+        "scaler_scale": scaler.scale_.tolist(),
+        "summary": summary,
+    }
+
+def create_clustering_catalogue(dataset):
+    """
+    This function precomputes the K-Means fits of the catalogue for a dataset and replaces the
+    dataset's entries in the clustering_catalogue table. The entries are tagged with the version
+    of the table they were fitted on, so the API ignores them once the table is rewritten.
+
+    Args:
+    - dataset: The name of the dataset, "postal" or "community"
+    """
+
+    dataset_info = CLUSTERING_DATASETS[dataset]
+    key = dataset_info["key"]
+
+    version = get_dataset_version(db_engine, dataset_info["table"])
+    if version is None:
+        logger.warning(f"create_clustering_catalogue(): No version recorded for '{dataset_info['table']}', skipping.")
+        return
+
+    df = pd.read_sql_table(dataset_info["table"], db_engine, columns = [key] + dataset_info["features"])
+    logger.info(f"create_clustering_catalogue(): Table '{dataset_info['table']}' loaded.")
+
+    # Labels are stored per key, which only identifies a row if the key is unique
+    if df[key].duplicated().any():
+        logger.warning(f"create_clustering_catalogue(): Column '{key}' is not unique in '{dataset_info['table']}', skipping.")
+        return
+
+    # The API sorts the rows by the key column before fitting
+    df = df.sort_values(key, kind = "stable").reset_index(drop = True)
+
+    entries = []
+
+    for feature_set in CLUSTERING_CATALOGUE[dataset]:
+        features = [
+            feature for feature in dataset_info["features"]
+            if feature_set is None or feature in feature_set
+        ]
+
+        for n_clusters in range(CATALOGUE_MIN_CLUSTERS, CATALOGUE_MAX_CLUSTERS + 1):
+            if n_clusters > len(df):
+                break
+            entries.append({"version": version, **fit_catalogue_entry(df, dataset, features, n_clusters)})
+
+    logger.info(f"create_clustering_catalogue(): {len(entries)} fits computed for '{dataset}'.")
+
+    try:
+        with db_engine.begin() as connection:
+            connection.execute(
+                text("DELETE FROM clustering_catalogue WHERE dataset = :dataset;"),
+                {"dataset": dataset}
+            )
+            if entries:
+                connection.execute(ClusteringCatalogueEntry.__table__.insert(), entries)
+        logger.info(f"create_clustering_catalogue(): Catalogue of '{dataset}' saved to the database.")
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred saving the catalogue of '{dataset}'")
+
+for dataset in CLUSTERING_DATASETS:
+    create_clustering_catalogue(dataset)
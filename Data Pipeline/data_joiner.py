@@ -11,6 +11,8 @@ import pandas as pd
 from scipy.spatial import KDTree
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
+import db_utils
+from db_utils import create_dataset_versions_table, drop_row_id, save_to_database
 
 # Create a logs directory if it does not exist
 log_directory = "logs"
@@ -30,8 +32,9 @@ file_handler.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 file_handler.setFormatter(formatter)
 
-# Add the file handler to the logger
+# Add the file handler to the logger and to the logger of the shared database functions
 logger.addHandler(file_handler)
+db_utils.logger.addHandler(file_handler)
 
 # Increase the maximum field size for CSV files
 csv.field_size_limit(sys.maxsize)
@@ -66,27 +69,8 @@ except SQLAlchemyError as e:
     logger.exception("An error occurred connecting to the database.")
     sys.exit(1)
 
-def save_to_database(df, table_name, is_geospatial = False):
-    """
-    This function saves the DataFrame or GeoDataFrame to the database as a table with 
-    the specified name.
-
-    Args:
-    - df: The DataFrame or GeoDataFrame to be saved
-    - table_name: The name of the table to be created in the database
-    - is_geospatial: A boolean indicating whether the DataFrame is a GeoDataFrame
-    """
-
-    try:
-        if is_geospatial:
-            # If GeoDataFrame, use the to_postgis method to save the data to the database
-            df.to_postgis(table_name, db_engine, if_exists = "replace", index = False)
-        else:
-            # If DataFrame, use the to_sql method to save the data to the database
-            df.to_sql(table_name, db_engine, if_exists = "replace", index = False)
-        logger.info(f"Data successfully saved to table '{table_name}'.")
-    except SQLAlchemyError as e:
-        logger.exception("An error occurred saving data to the database")
+# Create the table that records the version of each dataset written by the pipeline
+create_dataset_versions_table(db_engine)
 
 def create_combined_boundaries_and_profile_data_gdf():
     '''
@@ -96,20 +80,20 @@ def create_combined_boundaries_and_profile_data_gdf():
 
     # Import the community district boundaries, community profiles, total crimes, 
     # total disorders, and transit stops data
-    community_boundaries_gdf = gpd.read_postgis(
+    community_boundaries_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_district_boundaries;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
     community_boundaries_gdf = community_boundaries_gdf.to_crs(UTM_CRS)
 
-    transit_stops_gdf = gpd.read_postgis(
+    transit_stops_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM transit_stops;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
     transit_stops_gdf = transit_stops_gdf.to_crs(UTM_CRS)
 
     ne_transit_stops = gpd.sjoin(
@@ -121,10 +105,10 @@ def create_combined_boundaries_and_profile_data_gdf():
 
     ne_transit_stops = ne_transit_stops.drop(columns = ["index_right", "CREATED_DT", "MODIFIED_DT", "Status", "TeleRide Number"])
 
-    community_profiles_gdf = pd.read_sql_table("community_profiles", db_engine)
+    community_profiles_gdf = drop_row_id(pd.read_sql_table("community_profiles", db_engine))
 
-    total_crimes_df = pd.read_sql_table("community_crime_statistics", db_engine)
-    total_disorders_df = pd.read_sql_table("community_disorder_statistics", db_engine)
+    total_crimes_df = drop_row_id(pd.read_sql_table("community_crime_statistics", db_engine))
+    total_disorders_df = drop_row_id(pd.read_sql_table("community_disorder_statistics", db_engine))
 
     transit_stops_by_community_gdf = ne_transit_stops.groupby("Community Name")["Stop Name"].count().reset_index()
     transit_stops_by_community_gdf.columns = ["Community Name", "Transit Stops Count"]
@@ -221,65 +205,65 @@ def create_postal_codes_with_assessed_values_gdf(combined_gdf):
     combined_gdf = combined_gdf[["Community Name", "Class", "Sector", "SRG", "geometry"]]
 
     # Import the required datasets
-    postal_boundaries_gdf = gpd.read_postgis(
+    postal_boundaries_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM postal_boundaries;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
     postal_boundaries_gdf = postal_boundaries_gdf.to_crs(UTM_CRS)
 
-    current_year_property_assessments_df = gpd.read_postgis(
+    current_year_property_assessments_df = drop_row_id(gpd.read_postgis(
         "SELECT * FROM current_year_property_assessments;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
     current_year_property_assessments_df = current_year_property_assessments_df.to_crs(UTM_CRS)
 
-    land_use_districts_gdf = gpd.read_postgis(
+    land_use_districts_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM land_use_districts;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     land_use_districts_gdf = land_use_districts_gdf.to_crs(UTM_CRS)
 
-    schools_gdf = gpd.read_postgis(
+    schools_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM schools;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     schools_gdf = schools_gdf.to_crs(UTM_CRS)
 
-    community_services_gdf = gpd.read_postgis(
+    community_services_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_services;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     community_services_gdf = community_services_gdf.to_crs(UTM_CRS)
 
-    community_boundaries_gdf = gpd.read_postgis(
+    community_boundaries_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_district_boundaries;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
     community_boundaries_gdf = community_boundaries_gdf.to_crs(UTM_CRS)
 
-    transit_stops_gdf = gpd.read_postgis(
+    transit_stops_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM transit_stops;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
     transit_stops_gdf = transit_stops_gdf.to_crs(UTM_CRS)
 
     ne_transit_stops = gpd.sjoin(
@@ -460,12 +444,12 @@ def create_land_use_districts_info():
     descriptions.
     '''
 
-    land_use_districts_gdf = gpd.read_postgis(
+    land_use_districts_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM land_use_districts;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     land_use_districts_gdf = land_use_districts_gdf.to_crs(UTM_CRS)
 
@@ -484,19 +468,19 @@ def create_excluded_communities_gdf():
     analysis.
     '''
 
-    community_district_boundaries_full = gpd.read_postgis(
+    community_district_boundaries_full = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_district_boundaries_full;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
-    community_district_boundaries_filtered = gpd.read_postgis(
+    community_district_boundaries_filtered = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_district_boundaries;",
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     community_district_boundaries_filtered_gdf = community_district_boundaries_filtered.to_crs(UTM_CRS)
 
@@ -519,12 +503,12 @@ def create_excluded_postal_codes_gdf(excluded_communities_gdf):
       be excluded from the analysis.
     '''
 
-    postal_boundaries_gdf = gpd.read_postgis(
+    postal_boundaries_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM postal_boundaries;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
     excluded_postal_codes_gdf = gpd.sjoin(
         postal_boundaries_gdf,
@@ -544,19 +528,19 @@ def create_NE_transit_stops():
     Get the transit stops in the northeast area of Calgary.
     '''
 
-    transit_stops_gdf = gpd.read_postgis(
+    transit_stops_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM transit_stops;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
-    community_district_boundaries_gdf = gpd.read_postgis(
+    community_district_boundaries_gdf = drop_row_id(gpd.read_postgis(
         "SELECT * FROM community_district_boundaries;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
     NE_transit_stops = gpd.sjoin(
         transit_stops_gdf,
@@ -574,7 +558,7 @@ operation_count = 0
 start_time = time.time()
 
 combined_boundaries_and_profile_data_gdf = create_combined_boundaries_and_profile_data_gdf()
-save_to_database(combined_boundaries_and_profile_data_gdf, "combined_boundaries_and_profile_data", True)
+save_to_database(db_engine, combined_boundaries_and_profile_data_gdf, "combined_boundaries_and_profile_data", True, ["Community Name"])
 operation_count += 1
 
 logger.info("combined_boundaries_and_profile_data_gdf successfully saved to the database.")
@@ -582,29 +566,29 @@ logger.info("combined_boundaries_and_profile_data_gdf successfully saved to the
 postal_codes_with_assessed_values_gdf = create_postal_codes_with_assessed_values_gdf(
     combined_boundaries_and_profile_data_gdf
 )
-save_to_database(postal_codes_with_assessed_values_gdf, "postal_codes_with_assessed_values", True)
+save_to_database(db_engine, postal_codes_with_assessed_values_gdf, "postal_codes_with_assessed_values", True, ["Postal Code"])
 operation_count += 1
 
 logger.info("postal_codes_with_assessed_values_gdf successfully saved to the database.")
 
 land_use_districts_info_df = create_land_use_districts_info()
-save_to_database(land_use_districts_info_df, "land_use_districts_info")
+save_to_database(db_engine, land_use_districts_info_df, "land_use_districts_info", index_columns = ["Land Use Code"])
 operation_count += 1
 
 logger.info("land_use_districts_info_df successfully saved to the database.")
 
 excluded_communities_gdf = create_excluded_communities_gdf()
-save_to_database(excluded_communities_gdf, "excluded_communities_gdf", True)
+save_to_database(db_engine, excluded_communities_gdf, "excluded_communities_gdf", True)
 operation_count += 1
 
 logger.info("excluded_communities_gdf successfully saved to the database.")
 
 excluded_postal_codes_gdf = create_excluded_postal_codes_gdf(excluded_communities_gdf)
-save_to_database(excluded_postal_codes_gdf, "excluded_postal_codes_gdf", True)
+save_to_database(db_engine, excluded_postal_codes_gdf, "excluded_postal_codes_gdf", True)
 operation_count += 1
 
 NE_transit_stops_gdf = create_NE_transit_stops()
-save_to_database(NE_transit_stops_gdf, "ne_transit_stops_gdf", True)
+save_to_database(db_engine, NE_transit_stops_gdf, "ne_transit_stops_gdf", True)
 operation_count += 1
 
 logger.info("excluded_postal_codes_gdf successfully saved to the database.")
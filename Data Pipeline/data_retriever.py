@@ -11,6 +11,8 @@ import pandas as pd
 import requests
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
+import db_utils
+from db_utils import create_dataset_versions_table, save_to_database
 
 # Create a logs directory if it does not exist
 log_directory = "logs"
@@ -30,8 +32,9 @@ file_handler.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 file_handler.setFormatter(formatter)
 
-# Add the file handler to the logger
+# Add the file handler to the logger and to the logger of the shared database functions
 logger.addHandler(file_handler)
+db_utils.logger.addHandler(file_handler)
 
 # Increase the maximum field size for CSV files
 csv.field_size_limit(sys.maxsize)
@@ -66,6 +69,9 @@ except SQLAlchemyError as e:
     logger.exception("An error occurred connecting to the database.")
     sys.exit(1)
 
+# Create the table that records the version of each dataset written by the pipeline
+create_dataset_versions_table(db_engine)
+
 def construct_dataset_url(dataset_id):
     """
     This function constructs the URL for a City of Calgary Open Data Portal dataset with 
@@ -81,6 +87,7 @@ def construct_dataset_url(dataset_id):
 datasets_info = {
     "building_permits": {
         "url": construct_dataset_url("c2es-76ed"),
+        "indexes": ["CommunityName", "PermitType"],
     },
     "community_crime_statistics": {
         "url": construct_dataset_url("78gh-n26t"),
@@ -94,7 +101,8 @@ datasets_info = {
                               "Month", 
                               "Category", 
                               "Date"],
-        "columns_to_rename": {"Crime Count": "Community Crime Count 2023"}
+        "columns_to_rename": {"Crime Count": "Community Crime Count 2023"},
+        "indexes": ["Community Name"],
     },
     "community_disorder_statistics": {
         "url": construct_dataset_url("h3h6-kgme"),
@@ -104,6 +112,7 @@ datasets_info = {
                               "Month", 
                               "Category"],
         "columns_to_rename": {"Event Count": "Community Disorder Count 2023"},
+        "indexes": ["Community Name"],
     },
     "community_district_boundaries": {
         "url": construct_dataset_url("surr-xmvs"),
@@ -118,6 +127,7 @@ datasets_info = {
                               "MULTIPOLYGON": "geometry"},
         "drop_if_empty": "SRG",
         "convert_to_gpd": True,
+        "indexes": ["Community Name"],
     },
     "community_district_boundaries_full": {
         "url": construct_dataset_url("surr-xmvs"),
@@ -136,6 +146,7 @@ datasets_info = {
         "columns_to_float": ["Median Household Income", 
                              "Median Owner Monthly Shelter Cost", 
                              "Median Renter Monthly Shelter Cost"],
+        "indexes": ["Community Name"],
     },
     "community_services": {
         "url": construct_dataset_url("x34e-bcjz"),
@@ -146,6 +157,7 @@ datasets_info = {
                               "COMM_CODE": "Community Code", 
                               "POINT": "geometry"},
         "convert_to_gpd": True,
+        "indexes": ["Type", "Community Code"],
     },
     "current_year_property_assessments": {
         "url": construct_dataset_url("4bsw-nn7w"),
@@ -160,9 +172,11 @@ datasets_info = {
                               "LAND_SIZE_AC"],
         "columns_to_rename": {"MULTIPOLYGON": "geometry"},
         "convert_to_gpd": True,
+        "indexes": ["COMM_NAME", "PROPERTY_TYPE"],
     },
     "development_permits": {
         "url": construct_dataset_url("6933-unw5"),
+        "indexes": ["CommunityName"],
     },
     "land_use_districts": {
         "url": construct_dataset_url("qe6k-p9nh"),
@@ -179,6 +193,7 @@ datasets_info = {
                               "MAJOR": "Land Use Major", 
                               "MULTIPOLYGON": "geometry"},
         "convert_to_gpd": True,
+        "indexes": ["Land Use Code"],
     },
     "postal_boundaries": {
         "local_path_gpd": "../data/LDU/LDU.shp",
@@ -199,6 +214,7 @@ datasets_info = {
                               "LONGITUDE": "Longitude", 
                               "LATITUDE": "Latitude"},
         "convert_to_gpd": True,
+        "indexes": ["Postal Code"],
     },
     "schools": {
         "url": construct_dataset_url("fd9t-tdn2"),
@@ -221,6 +237,7 @@ datasets_info = {
                               "POINT": "geometry"},
         "filters": {"BOARD": "The Calgary School Division"},
         "convert_to_gpd": True,
+        "indexes": ["Postal Code"],
     },
     "transit_stops": {
         "url": construct_dataset_url("muzh-c9qc"),
@@ -396,28 +413,6 @@ def process_and_store_dataset(dataset_name, dataset_details):
 
     return df
 
-def save_to_database(df, table_name, is_geospatial = False):
-    """
-    This function saves the DataFrame or GeoDataFrame to the database as a table with 
-    the specified name.
-
-    Args:
-    - df: The DataFrame or GeoDataFrame to be saved
-    - table_name: The name of the table to be created in the database
-    - is_geospatial: A boolean indicating whether the DataFrame is a GeoDataFrame
-    """
-
-    try:
-        if is_geospatial:
-            # If GeoDataFrame, use the to_postgis method to save the data to the database
-            df.to_postgis(table_name, db_engine, if_exists = "replace", index = False)
-        else:
-            # If DataFrame, use the to_sql method to save the data to the database
-            df.to_sql(table_name, db_engine, if_exists = "replace", index = False)
-        logger.info(f"Data successfully saved to table '{table_name}'.")
-    except SQLAlchemyError as e:
-        logger.exception("An error occurred saving data to the database")
-
 total_run_time = 0
 
 for dataset_name, dataset_details in datasets_info.items():
@@ -425,10 +420,12 @@ for dataset_name, dataset_details in datasets_info.items():
 
     df = process_and_store_dataset(dataset_name, dataset_details)
 
+    index_columns = dataset_details["indexes"] if "indexes" in dataset_details else None
+
     if "convert_to_gpd" in dataset_details and dataset_details["convert_to_gpd"]:
-        save_to_database(df, dataset_name, True)
+        save_to_database(db_engine, df, dataset_name, True, index_columns)
     else:
-        save_to_database(df, dataset_name)
+        save_to_database(db_engine, df, dataset_name, index_columns = index_columns)
         
     end_time = time.time()
 
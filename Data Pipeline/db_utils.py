@@ -0,0 +1,321 @@
+import json
+import logging
+import uuid
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Create a logger. The pipeline scripts add their file handler to it, so these messages are
+# written to the log of the script that called the function.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Define the channel the API listens on for new dataset versions
+DATASET_VERSIONS_CHANNEL = "dataset_versions"
+
+# Define the column that numbers the rows of every table saved by the pipeline. The API pages through 
+# the tables on it. The API's ROW_ID_COLUMN must match it.
+ROW_ID_COLUMN = "__row_id"
+
+# Define the geometry column the spatial indexes are built on. The API filters bounding boxes on it, so 
+# the API's GEOMETRY_COLUMN must match it.
+GEOMETRY_COLUMN = "geometry"
+
+# Define the polygon layers that get simplified copies for low zoom levels, and the zoom levels 
+# of the copies. Each copy is stored as <table>_z<zoom> and is rebuilt every time the layer is 
+# saved. The API's SIMPLIFIED_LAYERS and SIMPLIFICATION_ZOOMS must match these.
+SIMPLIFIED_LAYERS = [
+    "community_district_boundaries",
+    "combined_boundaries_and_profile_data",
+    "excluded_communities_gdf",
+    "postal_boundaries",
+    "postal_codes_with_assessed_values",
+    "excluded_postal_codes_gdf",
+    "land_use_districts",
+]
+SIMPLIFICATION_ZOOMS = [6, 8, 10, 12]
+
+def create_dataset_versions_table(db_engine):
+    """
+    This function creates the table that records the version of each dataset written by the
+    pipeline, unless it already exists. The API caches its responses per dataset version.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    """
+
+    with db_engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS dataset_versions ("
+            "table_name TEXT PRIMARY KEY, "
+            "version TEXT NOT NULL, "
+            "updated_at TIMESTAMPTZ NOT NULL DEFAULT now());"
+        ))
+
+def record_dataset_version(db_engine, table_name):
+    """
+    This function records a new version for the table in the dataset_versions table. It is called
+    every time the table is rewritten so that the API stops serving cached responses built from
+    the previous data.
+
+    The new version is also sent as a notification on the dataset_versions channel. The API listens
+    on it and invalidates its caches as soon as the transaction commits.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the table that was rewritten
+    """
+
+    version = uuid.uuid4().hex
+
+    try:
+        with db_engine.begin() as connection:
+            connection.execute(
+                text(
+                    "INSERT INTO dataset_versions (table_name, version, updated_at) "
+                    "VALUES (:table_name, :version, now()) "
+                    "ON CONFLICT (table_name) DO UPDATE "
+                    "SET version = EXCLUDED.version, updated_at = EXCLUDED.updated_at;"
+                ),
+                {"table_name": table_name, "version": version}
+            )
+            connection.execute(
+                text("SELECT pg_notify(:channel, :payload);"),
+                {"channel": DATASET_VERSIONS_CHANNEL, "payload": json.dumps({"table_name": table_name, "version": version})}
+            )
+        logger.info(f"Recorded a new version for table '{table_name}'.")
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred recording the version of table '{table_name}'")
+
+def get_dataset_version(db_engine, table_name):
+    """
+    This function returns the version recorded for the table in the dataset_versions table, or
+    None if the pipeline has not recorded one.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the table
+    """
+
+    try:
+        with db_engine.connect() as connection:
+            result = connection.execute(
+                text("SELECT version FROM dataset_versions WHERE table_name = :table_name;"),
+                {"table_name": table_name}
+            )
+            return result.scalar_one_or_none()
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred reading the version of table '{table_name}'")
+        return None
+
+def create_row_id(db_engine, table_name):
+    """
+    This function numbers the rows of the table in a bigint identity column, in the order they were 
+    written, and makes it the primary key. The API pages through the table with WHERE row id > cursor 
+    ORDER BY row id, which the primary key index answers without reading or sorting the rest of the table.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the table
+    """
+
+    try:
+        with db_engine.begin() as connection:
+            connection.execute(text(
+                f'ALTER TABLE "{table_name}" '
+                f'ADD COLUMN "{ROW_ID_COLUMN}" BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY;'
+            ))
+        logger.info(f"Row id created for table '{table_name}'.")
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred creating the row id for table '{table_name}'")
+
+def drop_row_id(df):
+    """
+    This function returns the DataFrame or GeoDataFrame without the row ids of the tables it was read 
+    from, including the copies a merge or a spatial join suffixed. Row ids are only meaningful within 
+    the table that numbered them.
+
+    Args:
+    - df: The DataFrame or GeoDataFrame read from the database
+    """
+
+    return df.drop(columns = [column for column in df.columns if str(column).startswith(ROW_ID_COLUMN)])
+
+def create_spatial_index(db_engine, table_name):
+    """
+    This function creates a GIST index on the geometry column of the table, unless that column is already
+    indexed, and refreshes the table statistics. The API answers bounding box queries with the &&
+    operator, which uses this index.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the table with a geometry column
+    """
+
+    try:
+        with db_engine.begin() as connection:
+            existing_index = connection.execute(
+                text(
+                    "SELECT 1 FROM pg_indexes "
+                    "WHERE schemaname = current_schema() AND tablename = :table_name "
+                    "AND indexdef ILIKE :indexdef;"
+                ),
+                {"table_name": table_name, "indexdef": f"%USING gist ({GEOMETRY_COLUMN})%"}
+            ).first()
+
+            if existing_index is None:
+                connection.execute(
+                    text(f'CREATE INDEX "{table_name}_{GEOMETRY_COLUMN}_gist_idx" ON "{table_name}" USING GIST ("{GEOMETRY_COLUMN}");')
+                )
+
+            connection.execute(text(f'ANALYZE "{table_name}";'))
+        logger.info(f"Spatial index created for table '{table_name}'.")
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred creating the spatial index for table '{table_name}'")
+
+def create_column_indexes(db_engine, table_name, columns):
+    """
+    This function creates b-tree indexes on the columns of the table that API clients commonly
+    filter on, and refreshes the table statistics. The API compiles column filters into equality
+    conditions, so selective lookups on these columns become index scans.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the table
+    - columns: The names of the columns to be indexed
+    """
+
+    try:
+        with db_engine.begin() as connection:
+            for column in columns:
+                index_name = f"{table_name}_{column.lower().replace(' ', '_')}_idx"
+                connection.execute(text(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ("{column}");'))
+
+            connection.execute(text(f'ANALYZE "{table_name}";'))
+        logger.info(f"Column indexes created for table '{table_name}'.")
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred creating the column indexes for table '{table_name}'")
+
+def create_simplified_layer(db_engine, table_name, zoom):
+    """
+    This function creates a copy of a polygon layer with its geometry simplified for the given zoom 
+    level. The tolerance is the width of one pixel at that zoom level on 512 pixel map tiles (as used 
+    by Mapbox GL and Plotly), so the simplification is not visible at that zoom or below.
+
+    ST_SimplifyPreserveTopology never produces invalid or collapsed polygons, unlike ST_Simplify.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the polygon layer
+    - zoom: The zoom level the copy is meant for
+    """
+
+    simplified_table_name = f"{table_name}_z{zoom}"
+    tolerance = 360 / (512 * 2 ** zoom)
+
+    try:
+        with db_engine.begin() as connection:
+            columns = connection.execute(
+                text(
+                    "SELECT column_name FROM information_schema.columns "
+                    "WHERE table_schema = current_schema() AND table_name = :table_name "
+                    "ORDER BY ordinal_position;"
+                ),
+                {"table_name": table_name}
+            ).scalars().all()
+
+            select_list = ", ".join(
+                'ST_SimplifyPreserveTopology("geometry", :tolerance) AS "geometry"' if column == "geometry" else f'"{column}"'
+                for column in columns
+            )
+
+            connection.execute(text(f'DROP TABLE IF EXISTS "{simplified_table_name}";'))
+            connection.execute(
+                text(f'CREATE TABLE "{simplified_table_name}" AS SELECT {select_list} FROM "{table_name}";'),
+                {"tolerance": tolerance}
+            )
+
+            # The copy keeps the row ids of the layer, so the API pages through it the same way
+            if ROW_ID_COLUMN in columns:
+                connection.execute(text(f'ALTER TABLE "{simplified_table_name}" ADD PRIMARY KEY ("{ROW_ID_COLUMN}");'))
+    except SQLAlchemyError as e:
+        logger.exception(f"An error occurred creating the simplified layer '{simplified_table_name}'")
+        return
+
+    create_spatial_index(db_engine, simplified_table_name)
+    record_dataset_version(db_engine, simplified_table_name)
+
+    logger.info(f"Simplified layer '{simplified_table_name}' created.")
+
+def get_simplified_table(db_engine, table_name, zoom):
+    """
+    This function returns the name of the simplified copy of a polygon layer to read at the given 
+    zoom level: the coarsest copy that is still detailed enough at that zoom. It returns the layer 
+    itself if the zoom is beyond the most detailed copy or the copy does not exist.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - table_name: The name of the polygon layer
+    - zoom: The zoom level the layer is displayed at
+    """
+
+    levels = [level for level in SIMPLIFICATION_ZOOMS if level >= zoom]
+    if table_name not in SIMPLIFIED_LAYERS or not levels:
+        return table_name
+
+    simplified_table_name = f"{table_name}_z{min(levels)}"
+
+    with db_engine.connect() as connection:
+        exists = connection.execute(
+            text("SELECT to_regclass(CAST(:table_name AS text)) IS NOT NULL;"),
+            {"table_name": simplified_table_name}
+        ).scalar()
+
+    if not exists:
+        logger.warning(f"Simplified layer '{simplified_table_name}' not found, reading '{table_name}' instead.")
+        return table_name
+
+    return simplified_table_name
+
+def save_to_database(db_engine, df, table_name, is_geospatial = False, index_columns = None):
+    """
+    This function saves the DataFrame or GeoDataFrame to the database as a table with
+    the specified name, with its rows numbered in an indexed row id column. Polygon layers in 
+    SIMPLIFIED_LAYERS also get their simplified copies rebuilt.
+
+    Args:
+    - db_engine: The SQLAlchemy engine of the database
+    - df: The DataFrame or GeoDataFrame to be saved
+    - table_name: The name of the table to be created in the database
+    - is_geospatial: A boolean indicating whether the DataFrame is a GeoDataFrame
+    - index_columns: The names of the columns to be indexed for filtering
+    """
+
+    # The rows are numbered again once the table is written
+    df = drop_row_id(df)
+
+    try:
+        if is_geospatial:
+            # If GeoDataFrame, use the to_postgis method to save the data to the database
+            df.to_postgis(table_name, db_engine, if_exists = "replace", index = False)
+        else:
+            # If DataFrame, use the to_sql method to save the data to the database
+            df.to_sql(table_name, db_engine, if_exists = "replace", index = False)
+        logger.info(f"Data successfully saved to table '{table_name}'.")
+
+        create_row_id(db_engine, table_name)
+
+        if is_geospatial:
+            create_spatial_index(db_engine, table_name)
+
+        if index_columns:
+            create_column_indexes(db_engine, table_name, index_columns)
+
+        record_dataset_version(db_engine, table_name)
+    except SQLAlchemyError as e:
+        logger.exception("An error occurred saving data to the database")
+        return
+
+    # Rebuild the simplified copies, so they never serve the geometry of an earlier save
+    if table_name in SIMPLIFIED_LAYERS:
+        for zoom in SIMPLIFICATION_ZOOMS:
+            create_simplified_layer(db_engine, table_name, zoom)
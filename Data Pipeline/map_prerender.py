@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from datetime import datetime
+import hashlib
 import json
 import logging
 import os
@@ -13,6 +14,8 @@ from sqlalchemy import create_engine, text, Column, String
 from sqlalchemy.dialects.postgresql import JSON, insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker, declarative_base
+import db_utils
+from db_utils import create_dataset_versions_table, drop_row_id, get_simplified_table, record_dataset_version
 
 # Create a logs directory if it does not exist
 log_directory = "logs"
@@ -32,8 +35,9 @@ file_handler.setLevel(logging.INFO)
 formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 file_handler.setFormatter(formatter)
 
-# Add the file handler to the logger
+# Add the file handler to the logger and to the logger of the shared database functions
 logger.addHandler(file_handler)
+db_utils.logger.addHandler(file_handler)
 
 # Define the coordinate reference systems
 COORD_CRS = "EPSG:4326"
@@ -60,6 +64,15 @@ class MapData(Base):
     name = Column(String, primary_key = True)
     map_json = Column(JSON)
 
+# Define the class for the geometry shared by several maps. Maps store a reference to an asset 
+# instead of embedding its GeoJSON, and the API serves or embeds the asset. Versions are derived 
+# from the content, so an asset that did not change keeps its version across runs.
+class MapAsset(Base):
+    __tablename__ = "map_assets"
+    name = Column(String, primary_key = True)
+    version = Column(String, primary_key = True)
+    asset_json = Column(JSON)
+
 # Create a connection to the database
 connection_string = (
     f"postgresql://{RDS_USERNAME}:{RDS_PASSWORD}@" + 
@@ -76,28 +89,99 @@ try:
 except SQLAlchemyError as e:
     logger.exception("An error occurred connecting to the database.")
     sys.exit(1)
+
+# Create the table that records the version of each dataset written by the pipeline
+create_dataset_versions_table(db_engine)
     
 # Create the tables in the database
 Base.metadata.create_all(db_engine)
 
 Session = sessionmaker(bind = db_engine)
 
+# Define the (name, version) of the map assets published by this run
+published_assets = set()
+
+def publish_map_asset(name, geojson):
+    """
+    This function stores the GeoJSON of a map asset in the map_assets table, unless an asset with 
+    the same name and content has already been stored, and returns the version of the asset.
+
+    Args:
+    - name: The name of the asset
+    - geojson: The GeoJSON of the asset
+    """
+
+    version = hashlib.sha256(json.dumps(geojson, sort_keys = True).encode()).hexdigest()[:16]
+
+    if (name, version) not in published_assets:
+        with Session() as session:
+            stmt = insert(MapAsset).values(name = name, version = version, asset_json = geojson)
+            session.execute(stmt.on_conflict_do_nothing(index_elements = ["name", "version"]))
+            session.commit()
+
+        published_assets.add((name, version))
+        logger.info(f"publish_map_asset(): Asset '{name}' version {version} published.")
+
+    return version
+
+def detach_map_assets(figure_json, asset_names):
+    """
+    This function moves the GeoJSON of the traces of a figure into the map_assets table and 
+    replaces it with a reference to the asset. Maps that share boundaries then share one copy.
+
+    Args:
+    - figure_json: The figure, as returned by fig.to_json()
+    - asset_names: The name of the asset of each trace, in trace order. Traces without a name keep their GeoJSON.
+    """
+
+    figure = json.loads(figure_json)
+
+    for trace, asset_name in zip(figure["data"], asset_names):
+        if asset_name is None or "geojson" not in trace:
+            continue
+        version = publish_map_asset(asset_name, trace["geojson"])
+        trace["geojson"] = {"$asset": asset_name, "version": version}
+
+    return json.dumps(figure)
+
+def prune_map_assets():
+    """
+    This function deletes the map assets that are no longer referenced by a map, i.e. every 
+    asset that was not published by this run.
+    """
+
+    try:
+        with db_engine.begin() as connection:
+            connection.execute(
+                text(
+                    "DELETE FROM map_assets WHERE (name, version) NOT IN "
+                    "(SELECT * FROM unnest(CAST(:names AS TEXT[]), CAST(:versions AS TEXT[])));"
+                ),
+                {
+                    "names": [name for name, _ in published_assets], 
+                    "versions": [version for _, version in published_assets]
+                }
+            )
+        logger.info("prune_map_assets(): Unreferenced map assets deleted.")
+    except SQLAlchemyError as e:
+        logger.exception("An error occurred deleting unreferenced map assets")
+
 def create_congestion_map():
-    community_profiles_df = pd.read_sql_table(
+    community_profiles_df = drop_row_id(pd.read_sql_table(
         "community_profiles", 
         db_engine
-    )
+    ))
     logger.info("create_congestion_map(): Community profiles loaded.")
 
     community_profiles_df.rename(columns={"Count of Population in Private Households": "Population"}, inplace=True)
     population_data = community_profiles_df[["Community Name", "Population"]] 
 
-    community_boundaries_gdf = gpd.read_postgis(
-        "SELECT * FROM community_district_boundaries;", 
+    community_boundaries_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'community_district_boundaries', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     logger.info("create_congestion_map(): Community district boundaries loaded.")
 
@@ -110,12 +194,12 @@ def create_congestion_map():
 
     logger.info("create_congestion_map(): Data merged.")
 
-    excluded_communities_gdf = gpd.read_postgis(
-        "SELECT * FROM excluded_communities_gdf;", 
+    excluded_communities_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'excluded_communities_gdf', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     fig = px.choropleth_mapbox(
         merged_data,
@@ -147,13 +231,13 @@ def create_congestion_map():
     logger.info("create_congestion_map(): Choropleth map created.")
     logger.info("create_congestion_map(): Finished.")
 
-    return fig.to_json()
+    return detach_map_assets(fig.to_json(), ["community_boundaries", "excluded_communities"])
 
 def create_housing_development_zone_map():
-    development_permits_df = pd.read_sql_table(
+    development_permits_df = drop_row_id(pd.read_sql_table(
         "development_permits", 
         db_engine
-    )
+    ))
     
     development_permits_df = development_permits_df.rename(columns = {"CommunityName": "Community Name"})
 
@@ -162,12 +246,12 @@ def create_housing_development_zone_map():
 
     logger.info("create_housing_development_zone_map(): Development permits data loaded.")
 
-    community_boundaries_gdf = gpd.read_postgis(
-        "SELECT * FROM community_district_boundaries;", 
+    community_boundaries_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'community_district_boundaries', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     logger.info("create_housing_development_zone_map(): Community district boundaries loaded.")
 
@@ -180,12 +264,12 @@ def create_housing_development_zone_map():
 
     logger.info("create_housing_development_zone_map(): Data merged.")
 
-    excluded_communities_gdf = gpd.read_postgis(
-        "SELECT * FROM excluded_communities_gdf;", 
+    excluded_communities_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'excluded_communities_gdf', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     fig = px.choropleth_mapbox(
         merged_data,
@@ -214,27 +298,27 @@ def create_housing_development_zone_map():
     
     fig.add_trace(excluded_communities_layer)
 
-    return fig.to_json()
+    return detach_map_assets(fig.to_json(), ["community_boundaries", "excluded_communities"])
 
 def create_property_value_per_community_map():
-    current_year_property_assessments_df = gpd.read_postgis(
+    current_year_property_assessments_df = drop_row_id(gpd.read_postgis(
         "SELECT * FROM current_year_property_assessments;", 
         db_engine, 
         crs = COORD_CRS, 
         geom_col = "geometry"
-    )
+    ))
 
     mean_property_value_by_community = current_year_property_assessments_df.groupby("COMM_NAME")["ASSESSED_VALUE"].mean().reset_index()
     mean_property_value_by_community = mean_property_value_by_community[mean_property_value_by_community["ASSESSED_VALUE"] <= 10000000]
 
     logger.info("create_property_value_per_community_map(): Property value data loaded.")
 
-    community_boundaries_gdf = gpd.read_postgis(
-        "SELECT * FROM community_district_boundaries;", 
+    community_boundaries_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'community_district_boundaries', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     logger.info("create_property_value_per_community_map(): Community district boundaries loaded.")
 
@@ -247,12 +331,12 @@ def create_property_value_per_community_map():
 
     logger.info("create_property_value_per_community_map(): Data merged.")
 
-    excluded_communities_gdf = gpd.read_postgis(
-        "SELECT * FROM excluded_communities_gdf;", 
+    excluded_communities_gdf = drop_row_id(gpd.read_postgis(
+        f"SELECT * FROM {get_simplified_table(db_engine, 'excluded_communities_gdf', MAP_ZOOM)};", 
         db_engine,
         crs = COORD_CRS,
         geom_col = "geometry"
-    )
+    ))
 
     fig = px.choropleth_mapbox(
         merged_data,
@@ -284,20 +368,20 @@ def create_property_value_per_community_map():
 
     logger.info("create_property_value_per_community_map(): Map created.")
 
-    return fig.to_json()
+    return detach_map_assets(fig.to_json(), ["community_boundaries", "excluded_communities"])
 
 def create_vacancy_per_community_map():
-    building_permits_df = pd.read_sql_table(
+    building_permits_df = drop_row_id(pd.read_sql_table(
         "building_permits", 
         db_engine
-    )
+    ))
 
     logger.info("create_vacancy_per_community_map(): Building permits data loaded.")
 
-    vacant_apartments_df = pd.read_sql_table(
+    vacant_apartments_df = drop_row_id(pd.read_sql_table(
         "vacant_apartments", 
         db_engine
-    )
+    ))
 
     logger.info("create_vacancy_per_community_map(): Vacant apartments data loaded.")
 
@@ -361,6 +445,8 @@ with Session() as session:
 
     logger.info("create_congestion_map(): Successfully saved to the database.")
 
+record_dataset_version(db_engine, "map_data")
+
 housing_development_zone_map = create_housing_development_zone_map()
 
 with Session() as session:
@@ -379,6 +465,8 @@ with Session() as session:
 
     logger.info("create_housing_development_zone_map(): Successfully saved to the database.")
 
+record_dataset_version(db_engine, "map_data")
+
 property_value_per_community_map = create_property_value_per_community_map()
 
 with Session() as session:
@@ -397,6 +485,8 @@ with Session() as session:
 
     logger.info("create_property_value_per_community_map(): Successfully saved to the database.")
 
+record_dataset_version(db_engine, "map_data")
+
 vacancy_per_community_map = create_vacancy_per_community_map()
 
 with Session() as session:
@@ -413,4 +503,8 @@ with Session() as session:
     session.execute(do_update_stmt)
     session.commit()
 
-    logger.info("create_vacancy_per_community_map(): Successfully saved to the database.")
\ No newline at end of file
+    logger.info("create_vacancy_per_community_map(): Successfully saved to the database.")
+
+record_dataset_version(db_engine, "map_data")
+
+prune_map_assets()